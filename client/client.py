@@ -1,16 +1,17 @@
 #!/usr/bin/env python3
 
+import codecs
+import os
+import selectors
 from io import StringIO
 from sys import stdin, stdout
 from socket import AF_INET, SOCK_STREAM, socket
-from threading import Thread
 from cryptography.hazmat.primitives.asymmetric.rsa import (
     RSAPrivateNumbers,
     RSAPublicNumbers,
 )
 from cryptography.hazmat.primitives import serialization
 from argparse import ArgumentParser, Namespace
-import select
 
 from paramiko import Channel, RSAKey, Transport
 
@@ -52,32 +53,45 @@ def gen_rsa() -> bytes:
     )
 
 
-class InputListener(Thread):
-    """This is a thread that listens for console input,
-    and sends it down a channel when it receives some.
-    All logic is in the run method."""
-
-    chan: Channel
-    """Channel this shell is attached to."""
-
-    def __init__(self, chan: Channel) -> None:
-        self.chan = chan
-        super().__init__()
-
-    def run(self) -> None:
-        poll = select.poll()
-        poll.register(stdin.fileno())
-        outbytes = bytearray()
-        while not self.chan.closed:
-            if len(outbytes) > 0:
-                self.chan.send(outbytes)
-                outbytes = bytearray()
-
-            for _, event in poll.poll():
-                if event == select.POLLOUT:
-                    outbytes.extend(bytearray(stdin.readline(), "utf-8"))
-
-        self.chan.shutdown(2)
+def interact(chan: Channel) -> None:
+    """Bridges the console and a shell channel until the channel closes.
+    Sleeps until either console input or channel output is ready.
+    Output is decoded incrementally, so characters split across reads survive,
+    and is written to the console in one batch per wakeup."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    # epoll, the default on Linux, refuses regular files, but stdin may be redirected
+    # from one. poll reports them as always ready instead
+    selector = selectors.PollSelector()
+    selector.register(stdin.fileno(), selectors.EVENT_READ)
+    selector.register(chan, selectors.EVENT_READ)
+
+    while not chan.closed:
+        output = []
+        for key, _ in selector.select():
+            if key.fileobj is chan:
+                data = chan.recv(65536)
+                if len(data) == 0:
+                    output.append(decoder.decode(b"", final=True))
+                    chan.close()
+                    break
+
+                output.append(decoder.decode(data))
+                while chan.recv_ready():
+                    output.append(decoder.decode(chan.recv(65536)))
+            else:
+                data = os.read(key.fd, 65536)
+                if len(data) > 0:
+                    chan.sendall(data)
+                else:
+                    # EOF on the console, let the server know we are done sending
+                    selector.unregister(key.fd)
+                    chan.shutdown_write()
+
+        if output:
+            stdout.write("".join(output))
+            stdout.flush()
+
+    selector.close()
 
 
 ## Connecting
@@ -139,8 +153,4 @@ if __name__ == "__main__":
         chan = tsp.open_channel("session")
         chan.get_pty()
         chan.invoke_shell()
-        listener = InputListener(chan)
-        listener.start()
-        while not chan.closed:
-            stdout.write(chan.recv(2048).decode("utf-8"))
-        listener.join()
+        interact(chan)
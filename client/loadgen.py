@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import resource
+import threading
+import time
+from argparse import ArgumentParser, Namespace
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from socket import create_connection
+from typing import Any, Optional
+
+from paramiko import RSAKey, Transport
+
+## Connecting
+
+
+class Result:
+    """Timings of one connection, or the error that ended it."""
+
+    handshake: Optional[float]
+    """Seconds from connecting to finishing the key exchange, if it finished."""
+    auth: Optional[float]
+    """Seconds the server took to accept the public key, if it did."""
+    error: Optional[str]
+    """Name of the exception that ended the connection, if any."""
+
+    def __init__(self) -> None:
+        self.handshake = None
+        self.auth = None
+        self.error = None
+
+
+def offer_key(
+    addr: str, port: int, user: str, key: RSAKey, timeout: float, hold: float
+) -> Result:
+    """Connects to the server, offers it a public key and disconnects,
+    optionally holding the connection open for a while after authenticating."""
+    result = Result()
+    start = time.perf_counter()
+    try:
+        sock = create_connection((addr, port), timeout=timeout)
+        with Transport(sock) as tsp:
+            tsp.start_client(timeout=timeout)
+            handshaken = time.perf_counter()
+            result.handshake = handshaken - start
+
+            tsp.auth_publickey(user, key)
+            result.auth = time.perf_counter() - handshaken
+
+            if hold > 0:
+                time.sleep(hold)
+    except Exception as exc:
+        result.error = type(exc).__name__
+
+    return result
+
+
+## Reporting
+
+
+def percentiles(values: list[float]) -> Optional[dict[str, float]]:
+    """Returns the median, 99th percentile and maximum of some latencies."""
+    if not values:
+        return None
+
+    values = sorted(values)
+
+    def at(q: float) -> float:
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    return {"p50": at(0.5), "p99": at(0.99), "max": values[-1]}
+
+
+def summarise(results: list[Result], seconds: float, args: Namespace) -> dict[str, Any]:
+    """Summarises the results of a run."""
+    accepted = sum(1 for result in results if result.auth is not None)
+    return {
+        "connections": len(results),
+        "concurrency": args.concurrency,
+        "seconds": seconds,
+        "connections_per_second": len(results) / seconds,
+        "keys_accepted": accepted,
+        "keys_accepted_per_second": accepted / seconds,
+        "handshake_seconds": percentiles(
+            [result.handshake for result in results if result.handshake is not None]
+        ),
+        "auth_seconds": percentiles(
+            [result.auth for result in results if result.auth is not None]
+        ),
+        "errors": Counter(result.error for result in results if result.error),
+    }
+
+
+## CLI
+
+
+def parse_args() -> Namespace:
+    """Parses CLI arguments."""
+    parser = ArgumentParser(
+        prog="maldetete-loadgen",
+        description="Measures how quickly an SSH server accepts public keys"
+        + " by offering keys over many concurrent connections."
+        + " Prints a JSON summary.",
+    )
+
+    parser.add_argument(
+        "server",
+        help="Server to connect to. "
+        + "Of the form: [<username>@]<server address>[:<server port>]",
+    )
+
+    parser.add_argument(
+        "-n",
+        "--connections",
+        type=int,
+        default=1000,
+        help="Total number of connections to make. Default is 1000.",
+    )
+
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=256,
+        help="Number of connections open at once. Default is 256.",
+    )
+
+    parser.add_argument(
+        "-k",
+        "--private-key",
+        required=False,
+        help="Path to a PEM encoded RSA private key to offer on every connection.",
+    )
+
+    parser.add_argument(
+        "-u",
+        "--unique-keys",
+        type=int,
+        default=16,
+        help="Number of distinct keys to generate and offer in turn,"
+        + " if no private key is given. Default is 16.",
+    )
+
+    parser.add_argument(
+        "-b",
+        "--bits",
+        type=int,
+        default=1024,
+        help="Size of the generated keys. Default is 1024.",
+    )
+
+    parser.add_argument(
+        "-t",
+        "--timeout",
+        type=float,
+        default=30.0,
+        help="Seconds to wait for connecting and for the key exchange. Default is 30.",
+    )
+
+    parser.add_argument(
+        "--hold",
+        type=float,
+        default=0.0,
+        help="Seconds to keep each connection open after authenticating,"
+        + " to build up many concurrent sessions. Default is 0.",
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    user, _, dest = args.server.rpartition("@")
+    user = user or "loadgen"
+    addr, _, port = dest.partition(":")
+    port = int(port) if port else 2222
+
+    if args.private_key is None:
+        keys = [RSAKey.generate(args.bits) for _ in range(args.unique_keys)]
+    else:
+        keys = [RSAKey.from_private_key_file(args.private_key)]
+
+    # Errors are counted in the summary rather than logged with a traceback each
+    logging.getLogger("paramiko").addHandler(logging.NullHandler())
+
+    # Each connection holds a socket, and paramiko runs a thread per transport
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    threading.stack_size(512 * 1024)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [
+            pool.submit(
+                offer_key,
+                addr,
+                port,
+                user,
+                keys[i % len(keys)],
+                args.timeout,
+                args.hold,
+            )
+            for i in range(args.connections)
+        ]
+        results = [future.result() for future in futures]
+    seconds = time.perf_counter() - start
+
+    print(json.dumps(summarise(results, seconds, args), indent=2))
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+import multiprocessing
+import threading
+import time
+from math import gcd
+from multiprocessing.connection import Connection
+from typing import Callable, Optional
+
+from cache import PrivateNumbers
+
+# gmpy2's multiplication and division are quasi-linear where CPython's are not
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
+
+
+def product_tree(moduli: list[int]) -> list[list[int]]:
+    """Returns the levels of the product tree of the moduli, leaves first.
+    Each node is the product of its two children and the root is the product of all."""
+    tree = [moduli]
+    while len(tree[-1]) > 1:
+        level = tree[-1]
+        tree.append(
+            [level[i] * level[i + 1] for i in range(0, len(level) - 1, 2)]
+            + ([level[-1]] if len(level) % 2 else [])
+        )
+    return tree
+
+
+def merge_moduli(product: int, moduli: list[int]) -> tuple[int, list[int]]:
+    """Bernstein's batch GCD of new moduli against each other and against the product
+    of the moduli seen before, using a product tree and a remainder tree over the new
+    moduli only. Returns the product of all of them, as a gmpy2 integer if gmpy2 is
+    installed, and for each new modulus its GCD with the product of all the others,
+    old and new."""
+    if not moduli:
+        return product, []
+
+    if gmpy2 is not None:
+        product = gmpy2.mpz(product)
+        moduli = [gmpy2.mpz(n) for n in moduli]
+
+    # Starting from root * (product mod root) rather than the root leaves each leaf
+    # with n times the product of everything else, mod n^2
+    tree = product_tree(moduli)
+    root = tree[-1][0]
+    remainders = [root * (product % root)]
+    for level in reversed(tree[:-1]):
+        remainders = [remainders[i // 2] % (n * n) for i, n in enumerate(level)]
+
+    divide = gcd if gmpy2 is None else gmpy2.gcd
+    divisors = [int(divide(r // n, n)) for r, n in zip(remainders, moduli)]
+    return product * root, divisors
+
+
+def batch_gcd(moduli: list[int]) -> list[int]:
+    """Bernstein's batch GCD: for each modulus, returns its GCD with the product of
+    all the others, in quasi-linear time using a product tree and a remainder tree."""
+    return merge_moduli(1, moduli)[1]
+
+
+def merge_worker(conn: Connection) -> None:
+    """Entry point of the process that keeps the product of every modulus merged so
+    far. Merges each list of moduli it receives into it and sends back their divisors,
+    until the connection closes."""
+    product = 1
+    while True:
+        try:
+            moduli = conn.recv()
+        except EOFError:
+            return
+
+        product, divisors = merge_moduli(product, moduli)
+        conn.send(divisors)
+
+
+def private_numbers(n: int, e: int, p: int) -> Optional[PrivateNumbers]:
+    """Returns the private numbers of a key given one prime factor of its modulus,
+    or None if e is not invertible, which means it was not a valid RSA key."""
+    q = n // p
+    try:
+        d = pow(e, -1, (p - 1) * (q - 1))
+    except ValueError:
+        return None
+    return (p, q, d)
+
+
+class BatchGCD(threading.Thread):
+    """This is a thread that periodically runs batch GCD across every modulus seen,
+    breaking any keys that share a prime with another key.
+    Each run only sends the moduli added since the last one to a long-lived process,
+    which merges them into the product of the earlier ones that it keeps, so the big
+    integer arithmetic never holds up the server's threads. A run that fails is
+    reported and retried with a fresh process after the next interval.
+    All logic is in the run method."""
+
+    interval: float
+    """Seconds to wait between runs."""
+    on_broken: Callable[[int, int, PrivateNumbers], None]
+    """Called with n, e and the private numbers of each key that is broken."""
+
+    def __init__(
+        self,
+        on_broken: Callable[[int, int, PrivateNumbers], None],
+        interval: float = 60.0,
+    ) -> None:
+        self.on_broken = on_broken
+        self.interval = interval
+        self._exponents: dict[int, set[int]] = {}
+        self._added_moduli: list[int] = []
+        self._moduli: list[int] = []
+        self._factors: dict[int, int] = {}
+        self._broken: set[tuple[int, int]] = set()
+        self._added = threading.Event()
+        self._lock = threading.Lock()
+        self._worker: Optional[multiprocessing.Process] = None
+        self._conn: Optional[Connection] = None
+        self._closed = False
+        super().__init__(daemon=True)
+
+    def add(self, n: int, e: int) -> None:
+        """Adds a public key to be included in the next run."""
+        with self._lock:
+            exponents = self._exponents.get(n)
+            if exponents is None:
+                exponents = self._exponents[n] = set()
+                self._added_moduli.append(n)
+            if e in exponents:
+                return
+            exponents.add(e)
+        self._added.set()
+
+    def shutdown(self) -> None:
+        """Stops batch GCD and the process that runs it."""
+        self._closed = True
+        self._stop_worker()
+
+    def run(self) -> None:
+        """This method runs batch GCD every interval, if any keys were added since."""
+        while not self._closed:
+            self._added.wait()
+            self._added.clear()
+            try:
+                self.run_once()
+            except Exception as exc:
+                if self._closed:
+                    return
+                print(f"Batch GCD failed, retrying in {self.interval} s: {exc!r}")
+                self._stop_worker()
+                self._added.set()
+            time.sleep(self.interval)
+
+    def run_once(self) -> int:
+        """Runs batch GCD of the moduli added since the last run against each other and
+        every modulus seen before, and reports the keys it broke.
+        Returns the number of newly broken keys."""
+        with self._lock:
+            added, self._added_moduli = self._added_moduli, []
+
+        try:
+            divisors = self._merge(added)
+        except BaseException:
+            with self._lock:
+                self._added_moduli[:0] = added
+            raise
+
+        earlier = self._moduli
+        self._moduli = earlier + added
+
+        for n, g in zip(added, divisors):
+            if g == 1:
+                continue
+
+            # The earlier moduli that share a prime with n are only found through it
+            for m in earlier:
+                p = gcd(n, m)
+                if 1 < p < m and m not in self._factors:
+                    self._factors[m] = p
+
+            # Both primes are shared with other moduli, so find one of them pairwise
+            if g == n:
+                g = next((gcd(n, m) for m in self._moduli if 1 < gcd(n, m) < n), n)
+                if g == n:
+                    continue
+            self._factors[n] = g
+
+        # Keys sent later with the modulus of a broken key are broken as well
+        broken = 0
+        for n, p in self._factors.items():
+            broken += self._report(n, p)
+
+        return broken
+
+    def _merge(self, moduli: list[int]) -> list[int]:
+        """Sends moduli to the worker process to merge and returns their divisors.
+        A new worker process is first sent every earlier modulus to rebuild the
+        product that the last one held."""
+        if self._worker is None:
+            context = multiprocessing.get_context("forkserver")
+            self._conn, child = context.Pipe()
+            self._worker = context.Process(
+                target=merge_worker, args=(child,), daemon=True
+            )
+            self._worker.start()
+            child.close()
+
+            self._conn.send(self._moduli)
+            self._conn.recv()
+
+        self._conn.send(moduli)
+        return self._conn.recv()
+
+    def _stop_worker(self) -> None:
+        """Kills the worker process, if there is one."""
+        if self._worker is None:
+            return
+
+        self._conn.close()
+        self._worker.kill()
+        self._worker.join()
+        self._worker = None
+        self._conn = None
+
+    def _report(self, n: int, p: int) -> int:
+        """Reports every key with modulus n that has not been reported yet, given a
+        prime factor p of n. Returns the number of keys reported."""
+        with self._lock:
+            exponents = [e for e in self._exponents[n] if (n, e) not in self._broken]
+            self._broken.update((n, e) for e in exponents)
+
+        broken = 0
+        for e in exponents:
+            private = private_numbers(n, e, p)
+            if private is not None:
+                self.on_broken(n, e, private)
+                broken += 1
+
+        return broken
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import json
+import random
+import resource
+import time
+import tracemalloc
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ProcessPoolExecutor
+from statistics import median
+from typing import Any
+
+import shors
+
+DEFAULT_MODULI = [15, 21, 35, 77, 143, 323, 667, 1517, 3233]
+"""A semiprime of each size from 4 bits up to 12 bits."""
+
+
+def pick_base(n: int, seed: int) -> int:
+    """Picks a base coprime to n the same way for every backend."""
+    rng = random.Random(seed)
+    while True:
+        a = rng.randrange(2, n - 1)
+        if shors.gcd(a, n) == 1:
+            return a
+
+
+def trace_stages(a: int, n: int, backend: str, seed: int) -> list[dict[str, Any]]:
+    """Runs findPeriod with stage instrumentation under tracemalloc, returning the
+    time, register sizes and entanglements of each stage and the memory it allocated."""
+    stages = []
+    allocated_before = 0
+
+    def record(event: str, stage: str, info: dict[str, Any]) -> None:
+        nonlocal allocated_before
+        if event == "start":
+            allocated_before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            return
+
+        current, peak = tracemalloc.get_traced_memory()
+        info["stage"] = stage
+        info["allocated_bytes"] = current - allocated_before
+        info["peak_bytes"] = peak - allocated_before
+        stages.append(info)
+
+    random.seed(seed)
+    shors.instrument = record
+    tracemalloc.start()
+    try:
+        shors.findPeriod(a, n, backend, cached=False)
+    finally:
+        tracemalloc.stop()
+        shors.instrument = None
+
+    return stages
+
+
+def run_case(n: int, backend: str, seed: int, repeat: int) -> dict[str, Any]:
+    """Times findPeriod and shors() for one modulus on one backend.
+    Runs in a fresh process so the peak RSS belongs to this case alone."""
+    shors.printInfo = shors.printNone
+    a = pick_base(n, seed)
+
+    times = []
+    for i in range(repeat):
+        random.seed(seed + i)
+        start = time.perf_counter()
+        period = shors.findPeriod(a, n, backend, cached=False)
+        times.append(time.perf_counter() - start)
+
+    random.seed(seed)
+    start = time.perf_counter()
+    factors = shors.shors(n, 20, 0.01, 2, backend, cached=False)
+    shors_seconds = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    return {
+        "n": n,
+        "bits": n.bit_length(),
+        "backend": backend,
+        "seed": seed,
+        "a": a,
+        "period": period,
+        "find_period_seconds": {"min": min(times), "median": median(times)},
+        "shors_seconds": shors_seconds,
+        "factors": factors if factors else None,
+        "peak_rss_bytes": peak_rss,
+        "stages": trace_stages(a, n, backend, seed),
+    }
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(
+        prog="maldetete-benchmark",
+        description="Benchmarks the Shor's algorithm simulator."
+        + " Prints one JSON object per modulus and backend.",
+    )
+
+    parser.add_argument(
+        "-n",
+        "--moduli",
+        type=int,
+        nargs="+",
+        default=DEFAULT_MODULI,
+        help="Moduli to factor. Default is a semiprime of each size up to 12 bits.",
+    )
+
+    parser.add_argument(
+        "-b",
+        "--backends",
+        nargs="+",
+        choices=shors.BACKENDS,
+        default=[b for b in shors.BACKENDS if b == "object" or shors.np is not None],
+        help="Backends to benchmark. Default is every available backend.",
+    )
+
+    parser.add_argument(
+        "--max-object-bits",
+        type=int,
+        default=8,
+        help="Largest modulus in bits to run on the object backend,"
+        + " which runs in pure Python. Default is 8.",
+    )
+
+    parser.add_argument(
+        "-s", "--seed", type=int, default=0, help="RNG seed. Default is 0."
+    )
+
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of times to time findPeriod. Default is 3.",
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    for n in args.moduli:
+        for backend in args.backends:
+            if backend == "object" and n.bit_length() > args.max_object_bits:
+                continue
+
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                case = pool.submit(run_case, n, backend, args.seed, args.repeat)
+                print(json.dumps(case.result()), flush=True)
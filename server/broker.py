@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.managers import BaseManager
+from typing import Any, Optional
+
+from cache import PrivateNumbers
+
+Job = tuple[int, int, int, dict[str, Any]]
+"""A factoring job: its id, n and e of the public key, and the parameters to use."""
+
+JobResult = tuple[int, Optional[PrivateNumbers], Optional[str]]
+"""The outcome of a job: its id, the private numbers if the key was broken,
+and the error the worker raised, if any."""
+
+
+class JobManager(BaseManager):
+    """Manager serving the job, start and result queues of a broker over a socket.
+    Workers connect to it and call jobs(), started() and results() for proxies to
+    the queues, and put the id of each job they take in started."""
+
+
+JobManager.register("jobs")
+JobManager.register("started")
+JobManager.register("results")
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    """Parses a host:port address."""
+    host, _, port = address.rpartition(":")
+    return (host or "0.0.0.0", int(port))
+
+
+class JobBroker(threading.Thread):
+    """This is a thread that publishes factoring jobs to worker processes, which may be
+    on other hosts, and completes the future of each job when its result comes back.
+    Jobs that get no result within the timeout of a worker taking them, because their
+    worker died, fail. Jobs still waiting for a worker never time out.
+    All logic is in the run method."""
+
+    address: tuple[str, int]
+    """Address the job, start and result queues are served on."""
+    params: dict[str, Any]
+    """Parameters sent with every job."""
+    timeout: float
+    """Seconds a job may take once a worker has taken it before it is failed."""
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        authkey: bytes,
+        params: Optional[dict[str, Any]] = None,
+        timeout: float = 600.0,
+    ) -> None:
+        self.params = params if params is not None else {}
+        self.timeout = timeout
+        self._jobs: queue.Queue = queue.Queue()
+        self._taken: queue.Queue = queue.Queue()
+        self._results: queue.Queue = queue.Queue()
+        self._futures: dict[int, tuple[Future, Optional[float]]] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+        # Registering on a subclass keeps the queues of each broker separate
+        class Manager(JobManager):
+            pass
+
+        Manager.register("jobs", callable=lambda: self._jobs)
+        Manager.register("started", callable=lambda: self._taken)
+        Manager.register("results", callable=lambda: self._results)
+        self._server = Manager(address, authkey).get_server()
+        self.address = self._server.address
+
+        super().__init__(daemon=True)
+
+    def submit(self, n: int, e: int) -> Future:
+        """Publishes a job to factor a public key.
+        Returns a future of its private numbers, or None if it could not be broken."""
+        future: Future = Future()
+        future.set_running_or_notify_cancel()
+        job_id = next(self._ids)
+        with self._lock:
+            self._futures[job_id] = (future, None)
+        self._jobs.put((job_id, n, e, self.params))
+        return future
+
+    def shutdown(self) -> None:
+        """Fails every job that has not finished yet."""
+        with self._lock:
+            futures = list(self._futures.values())
+            self._futures.clear()
+        for future, _ in futures:
+            future.set_exception(RuntimeError("Job broker shut down"))
+
+    def run(self) -> None:
+        """This method serves the queues and completes futures as results arrive."""
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+        while True:
+            try:
+                job_id, private, error = self._results.get(timeout=1.0)
+            except queue.Empty:
+                pass
+            else:
+                self._finish(job_id, private, error)
+
+            self._acknowledge()
+            self._expire()
+
+    def _finish(
+        self, job_id: int, private: Optional[PrivateNumbers], error: Optional[str]
+    ) -> None:
+        """Completes the future of a job with its result."""
+        with self._lock:
+            future, _ = self._futures.pop(job_id, (None, None))
+        if future is None:
+            return
+
+        if error is not None:
+            future.set_exception(RuntimeError(error))
+        else:
+            future.set_result(private)
+
+    def _acknowledge(self) -> None:
+        """Starts the timeout of the jobs workers have taken since the last call."""
+        due = time.monotonic() + self.timeout
+        while True:
+            try:
+                job_id = self._taken.get_nowait()
+            except queue.Empty:
+                return
+
+            with self._lock:
+                if job_id in self._futures:
+                    self._futures[job_id] = (self._futures[job_id][0], due)
+
+    def _expire(self) -> None:
+        """Fails the jobs that are past their timeout."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                job
+                for job, (_, due) in self._futures.items()
+                if due is not None and due < now
+            ]
+            futures = [self._futures.pop(job)[0] for job in expired]
+        for future in futures:
+            future.set_exception(TimeoutError("No worker returned a result in time"))
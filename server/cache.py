@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import shelve
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional
+
+PrivateNumbers = tuple[int, int, int]
+"""The private numbers (p, q, d) of an RSA key."""
+
+
+class FactorCache:
+    """Cache of the private numbers of RSA keys that have been broken, keyed by (n, e).
+
+    Lookups go to an in-memory LRU tier first, then to an optional on-disk shelf
+    that survives restarts.
+    """
+
+    capacity: int
+    """Maximum number of keys held in the in-memory tier."""
+    path: Optional[str]
+    """Path of the on-disk tier, or None to only cache in memory."""
+
+    def __init__(self, path: Optional[str] = None, capacity: int = 1024) -> None:
+        self.capacity = capacity
+        self.path = path
+        self._memory: OrderedDict[tuple[int, int], PrivateNumbers] = OrderedDict()
+        self._lock = Lock()
+        self._disk = shelve.open(path) if path is not None else None
+
+    def get(self, n: int, e: int) -> Optional[PrivateNumbers]:
+        """Returns the cached private numbers for a public key, if there are any."""
+        key = (n, e)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+            if self._disk is None:
+                return None
+
+            private = self._disk.get(f"{n}:{e}")
+            if private is not None:
+                private = tuple(private)
+                self._remember(key, private)
+            return private
+
+    def put(self, n: int, e: int, private: PrivateNumbers) -> None:
+        """Stores the private numbers for a public key in both tiers."""
+        with self._lock:
+            self._remember((n, e), private)
+            if self._disk is not None:
+                self._disk[f"{n}:{e}"] = private
+                self._disk.sync()
+
+    def close(self) -> None:
+        """Flushes and closes the on-disk tier."""
+        with self._lock:
+            if self._disk is not None:
+                self._disk.close()
+                self._disk = None
+
+    def _remember(self, key: tuple[int, int], private: PrivateNumbers) -> None:
+        """Adds an entry to the in-memory tier, evicting the least recently used.
+        Must be called with the lock held."""
+        self._memory[key] = private
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.capacity:
+            self._memory.popitem(last=False)
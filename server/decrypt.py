@@ -1,35 +1,38 @@
 #!/usr/bin/env python3
 
-from math import log2
 from re import VERBOSE
 from typing import Optional
-from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey, RSAPublicKey
-from shors import shors
-
-
-def decrypt_pubkey(pubkey: RSAPublicKey):
-    """
-    Derives a private RSA key from the public key and prints its parameters.
-
-    RSA keys have the satisfy the following equation:
-    m^(e*d) ≡ m (mod n)
-    Here m is the message, e and n are known are d is to be found.
-    """
-    pubints = pubkey.public_numbers()
-    if log2(pubints.n) > 8:
-        print(
-            "Factoring an integer larger than 8 bits is likely going to take a long time."
-            + " Try with something smaller."
-        )
-        return
-
-    print(f"Decrypting public key with numbers {pubints}")
-    factors = shors(pubints.n, attempts=20, neighborhood=0.01, numPeriods=2)
-    if factors is None or factors is False:
-        print(f"Failed to factors integer {pubints.n}")
-        return
-
-    [p, q] = factors
-    totient = (p - 1) * (q - 1)
-    d = pow(pubints.e, -1, totient)
+
+from batchgcd import private_numbers
+from cache import FactorCache, PrivateNumbers
+from factor import DEFAULT_STAGES, Stage, factor, is_probable_prime
+
+cache = FactorCache()
+"""Private numbers of keys that have already been broken.
+Replace with a FactorCache that has a path to persist them across restarts."""
+
+
+def derive_private_numbers(
+    n: int, e: int, stages: list[Stage] = DEFAULT_STAGES
+) -> Optional[PrivateNumbers]:
+    """Factors the modulus of an RSA public key with the factoring pipeline
+    and returns the private numbers (p, q, d), or None if it failed.
+    Moduli with more than two prime factors and exponents that are not invertible
+    are not valid RSA keys, so they fail too."""
+    factors = factor(n, stages)
+    if factors is None:
+        return None
+
+    [p, q, method] = factors
+    print(f"Factored integer {n} using {method}")
+    if not (is_probable_prime(p) and is_probable_prime(q)):
+        print(f"Integer {n} has more than two prime factors")
+        return None
+
+    return private_numbers(n, e, p)
+
+
+def print_private_numbers(private: PrivateNumbers):
+    """Prints the private numbers of a broken key."""
+    [p, q, d] = private
     print(f"Found private numbers: p = {p}, q = {q}, d = {d}")
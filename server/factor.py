@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+
+import random
+import time
+from functools import lru_cache
+from math import gcd, isqrt
+from typing import Callable, Optional, Union
+
+FindFactor = Callable[[int, float], Optional[int]]
+"""Tries to find a factor of n before a deadline on the monotonic clock."""
+
+
+class Stage:
+    """One strategy in the factoring pipeline, with the time it may spend per key."""
+
+    name: str
+    """Name of the strategy, reported when it breaks a key."""
+    find_factor: FindFactor
+    """Function trying to find a factor of a modulus."""
+    budget: float
+    """Seconds the strategy may spend on each modulus."""
+    max_bits: Union[int, Callable[[], int], None]
+    """Size of the largest modulus the strategy is tried on, a function returning it
+    when it depends on the resources available, or None for any size."""
+
+    def __init__(
+        self,
+        name: str,
+        find_factor: FindFactor,
+        budget: float,
+        max_bits: Union[int, Callable[[], int], None] = None,
+    ) -> None:
+        self.name = name
+        self.find_factor = find_factor
+        self.budget = budget
+        self.max_bits = max_bits
+
+
+## Strategies
+
+
+class _FactorFound(Exception):
+    """Raised when an elliptic curve operation stumbles on a factor."""
+
+    def __init__(self, factor: int) -> None:
+        self.factor = factor
+        super().__init__(factor)
+
+
+@lru_cache(maxsize=4)
+def _primes_up_to(bound: int) -> list[int]:
+    """Returns the primes up to and including bound, using a sieve of Eratosthenes."""
+    sieve = bytearray([1]) * (bound + 1)
+    sieve[:2] = b"\0\0"
+    for p in range(2, isqrt(bound) + 1):
+        if sieve[p]:
+            sieve[p * p :: p] = bytearray(len(range(p * p, bound + 1, p)))
+    return [p for p, prime in enumerate(sieve) if prime]
+
+
+def _prime_power(p: int, bound: int) -> int:
+    """Returns the largest power of p that is at most bound."""
+    power = p
+    while power * p <= bound:
+        power *= p
+    return power
+
+
+def is_probable_prime(n: int, rounds: int = 20) -> bool:
+    """Miller-Rabin primality test."""
+    if n < 2:
+        return False
+    for p in _primes_up_to(50):
+        if n % p == 0:
+            return n == p
+
+    d, s = n - 1, 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+
+    for _ in range(rounds):
+        x = pow(random.randrange(2, n - 1), d, n)
+        if x in (1, n - 1):
+            continue
+        for _ in range(s - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+
+    return True
+
+
+def trial_division(n: int, deadline: float, bound: int = 1 << 20) -> Optional[int]:
+    """Finds factors up to bound by dividing by each prime."""
+    for i, p in enumerate(_primes_up_to(bound)):
+        if p * p > n:
+            return None
+        if n % p == 0:
+            return p
+        if i % 4096 == 4095 and time.monotonic() > deadline:
+            return None
+    return None
+
+
+def fermat(n: int, deadline: float) -> Optional[int]:
+    """Fermat's method, which quickly finds factors that are close to each other."""
+    a = isqrt(n)
+    if a * a < n:
+        a += 1
+    b2 = a * a - n
+
+    i = 0
+    while True:
+        b = isqrt(b2)
+        if b * b == b2:
+            return a - b
+
+        b2 += 2 * a + 1
+        a += 1
+        i += 1
+        if i % 4096 == 0 and time.monotonic() > deadline:
+            return None
+
+
+def pollard_rho(n: int, deadline: float) -> Optional[int]:
+    """Pollard's rho method with Brent's cycle detection,
+    which finds a factor p in about sqrt(p) steps."""
+    if n % 2 == 0:
+        return 2
+
+    batch = 128
+    while time.monotonic() < deadline:
+        y, c = random.randrange(1, n), random.randrange(1, n)
+        g = r = q = 1
+        while g == 1:
+            x = y
+            for _ in range(r):
+                y = (y * y + c) % n
+
+            k = 0
+            while k < r and g == 1:
+                ys = y
+                for _ in range(min(batch, r - k)):
+                    y = (y * y + c) % n
+                    q = q * abs(x - y) % n
+                g = gcd(q, n)
+                k += batch
+
+            r *= 2
+            if g == 1 and time.monotonic() > deadline:
+                return None
+
+        # The batched product overshot, step through the last batch one at a time
+        if g == n:
+            g = 1
+            while g == 1:
+                ys = (ys * ys + c) % n
+                g = gcd(abs(x - ys), n)
+
+        if g != n:
+            return g
+
+    return None
+
+
+def pollard_p_minus_1(n: int, deadline: float, bound: int = 1 << 20) -> Optional[int]:
+    """Pollard's p - 1 method, which finds factors p where p - 1 is smooth."""
+    a = 2
+    for i, p in enumerate(_primes_up_to(bound)):
+        a = pow(a, _prime_power(p, bound), n)
+        if i % 256 == 0:
+            g = gcd(a - 1, n)
+            if g == n:
+                return None
+            if g > 1:
+                return g
+            if time.monotonic() > deadline:
+                return None
+
+    g = gcd(a - 1, n)
+    return g if 1 < g < n else None
+
+
+def _inverse(x: int, n: int) -> int:
+    """Returns the inverse of x modulo n, raising _FactorFound if it does not exist."""
+    try:
+        return pow(x, -1, n)
+    except ValueError:
+        raise _FactorFound(gcd(x, n))
+
+
+def _ec_add(
+    p1: Optional[tuple[int, int]], p2: Optional[tuple[int, int]], a: int, n: int
+) -> Optional[tuple[int, int]]:
+    """Adds two points on the curve y^2 = x^3 + ax + b modulo n.
+    None is the point at infinity."""
+    if p1 is None:
+        return p2
+    if p2 is None:
+        return p1
+
+    (x1, y1), (x2, y2) = p1, p2
+    if x1 == x2:
+        if (y1 + y2) % n == 0:
+            return None
+        slope = (3 * x1 * x1 + a) * _inverse(2 * y1 % n, n) % n
+    else:
+        slope = (y2 - y1) * _inverse((x2 - x1) % n, n) % n
+
+    x3 = (slope * slope - x1 - x2) % n
+    return (x3, (slope * (x1 - x3) - y1) % n)
+
+
+def _ec_multiply(
+    point: Optional[tuple[int, int]], k: int, a: int, n: int
+) -> Optional[tuple[int, int]]:
+    """Multiplies a point on the curve by k with double and add."""
+    result = None
+    while k > 0:
+        if k & 1:
+            result = _ec_add(result, point, a, n)
+        point = _ec_add(point, point, a, n)
+        k >>= 1
+    return result
+
+
+def ecm(n: int, deadline: float, bound: int = 10000) -> Optional[int]:
+    """Lenstra's elliptic curve method on random curves, which finds factors p
+    whose curve group order is bound-smooth for one of the curves tried."""
+    primes = _primes_up_to(bound)
+    while time.monotonic() < deadline:
+        # Pick the point and a, which fixes b for the curve to pass through the point
+        point = (random.randrange(n), random.randrange(n))
+        a = random.randrange(n)
+        try:
+            for i, p in enumerate(primes):
+                point = _ec_multiply(point, _prime_power(p, bound), a, n)
+                if point is None:
+                    break
+                if i % 64 == 0 and time.monotonic() > deadline:
+                    return None
+        except _FactorFound as found:
+            if 1 < found.factor < n:
+                return found.factor
+
+    return None
+
+
+SHOR_DEMO_BITS = 8
+"""Size of the largest modulus Shor's algorithm is demonstrated on.
+Larger moduli take seconds to minutes to simulate, where trial division is instant."""
+
+shor_processes = 1
+"""Number of processes that may simulate Shor's algorithm at once,
+which share the memory available to it."""
+
+
+def set_shor_processes(processes: int) -> None:
+    """Sets how many processes may simulate Shor's algorithm at once.
+    Worker pools call it as their initializer."""
+    global shor_processes
+    shor_processes = processes
+
+
+def shor_max_bits() -> int:
+    """Size of the largest modulus Shor's algorithm is tried on: the demonstration
+    limit, or less if the registers of every process simulating at once would not
+    fit in the memory available now.
+    The simulator and numpy are only imported once a modulus gets this far."""
+    from shors import bitLimit
+
+    return min(SHOR_DEMO_BITS, bitLimit(processes=shor_processes))
+
+
+def shor(n: int, _deadline: float) -> Optional[int]:
+    """Shor's algorithm on the quantum simulator.
+    The simulation cannot be interrupted, so the deadline is not enforced."""
+    from shors import shors
+
+    factors = shors(n, attempts=20, neighborhood=0.01, numPeriods=2)
+    if factors is None or factors is False:
+        return None
+
+    for f in factors:
+        if 1 < f < n and n % f == 0:
+            return f
+    return None
+
+
+## Pipeline
+
+DEFAULT_STAGES = [
+    Stage("Shor's algorithm", shor, budget=300.0, max_bits=shor_max_bits),
+    Stage("trial division", trial_division, budget=0.05),
+    Stage("Fermat's method", fermat, budget=0.2),
+    Stage("Pollard's rho", pollard_rho, budget=1.0),
+    Stage("Pollard's p - 1", pollard_p_minus_1, budget=1.0),
+    Stage("the elliptic curve method", ecm, budget=2.0),
+]
+"""The stages tried on every key, in order.
+Shor's algorithm is only simulated for moduli small enough to demonstrate it
+whose registers fit in memory."""
+
+
+def factor(
+    n: int, stages: list[Stage] = DEFAULT_STAGES
+) -> Optional[tuple[int, int, str]]:
+    """Runs each stage on n until one finds a factor, spending at most its budget.
+    Returns the two factors and the name of the stage that found them,
+    or None if n is prime or every stage ran out of time."""
+    if is_probable_prime(n):
+        return None
+
+    for stage in stages:
+        max_bits = stage.max_bits() if callable(stage.max_bits) else stage.max_bits
+        if max_bits is not None and n.bit_length() > max_bits:
+            continue
+
+        p = stage.find_factor(n, time.monotonic() + stage.budget)
+        if p is not None and 1 < p < n and n % p == 0:
+            return (p, n // p, stage.name)
+
+    return None
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from threading import Lock
+from typing import Optional
+
+from batchgcd import BatchGCD
+from broker import JobBroker
+from cache import PrivateNumbers
+from factor import set_shor_processes
+from store import KeyStore
+
+
+class FactoringScheduler:
+    """Factors public keys on a pool of worker processes behind a bounded queue,
+    or publishes them to remote workers through a job broker.
+
+    Submitting never blocks: keys that are already cached are reported straight away,
+    keys that are already queued are not queued twice, and once the queue is full
+    new keys are dropped until a worker frees up.
+    Every key is also included in periodic batch GCD runs across all keys seen."""
+
+    workers: int
+    """Number of local worker processes factoring keys."""
+    broker: Optional[JobBroker]
+    """Broker publishing keys to remote workers instead, if any."""
+    max_pending: int
+    """Maximum number of keys queued or being factored at once."""
+    batch_gcd: BatchGCD
+    """Thread running batch GCD across every key submitted."""
+    store: Optional[KeyStore]
+    """Store to record the outcome of factoring each key in, if any."""
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        max_pending: int = 64,
+        batch_interval: float = 60.0,
+        store: Optional[KeyStore] = None,
+        broker: Optional[JobBroker] = None,
+    ) -> None:
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.broker = broker
+        self.max_pending = max_pending
+        self.store = store
+        self.batch_gcd = BatchGCD(self._broken, batch_interval)
+        if store is not None:
+            for n, e in store.public_numbers():
+                self.batch_gcd.add(n, e)
+        self.batch_gcd.start()
+        self._pool = None
+        if broker is None:
+            # Forking from the server's threads could copy locks they hold into the
+            # workers, so they are started from a single-threaded fork server instead.
+            # Every worker may simulate Shor's algorithm at once, so they split the
+            # memory for it between them
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("forkserver"),
+                initializer=set_shor_processes,
+                initargs=(self.workers,),
+            )
+        self._pending: dict[tuple[int, int], Future] = {}
+        self._lock = Lock()
+
+    @property
+    def depth(self) -> int:
+        """Number of keys currently queued or being factored."""
+        with self._lock:
+            return len(self._pending)
+
+    def submit(self, n: int, e: int) -> bool:
+        """Queues an RSA public key to be factored.
+        Returns False if it was dropped because the queue is full."""
+        import decrypt
+
+        self.batch_gcd.add(n, e)
+
+        private = decrypt.cache.get(n, e)
+        if private is not None:
+            self._set_result(n, e, "broken", private)
+            decrypt.print_private_numbers(private)
+            return True
+
+        key = (n, e)
+        with self._lock:
+            if key in self._pending:
+                return True
+
+            if len(self._pending) >= self.max_pending:
+                print(f"Factoring queue is full, dropping public key with modulus {n}")
+                self._set_result(n, e, "dropped")
+                return False
+
+            if self._pool is not None:
+                future = self._pool.submit(decrypt.derive_private_numbers, n, e)
+            else:
+                future = self.broker.submit(n, e)
+            self._pending[key] = future
+            depth = len(self._pending)
+
+        print(f"Queued public key with modulus {n} ({depth}/{self.max_pending} queued)")
+        self._set_result(n, e, "queued")
+        future.add_done_callback(lambda future: self._finish(n, e, future))
+        return True
+
+    def shutdown(self) -> None:
+        """Stops the workers, abandoning any keys still queued."""
+        self.batch_gcd.shutdown()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        else:
+            self.broker.shutdown()
+
+    def _finish(self, n: int, e: int, future: Future) -> None:
+        """Records the result of a finished job."""
+        import decrypt
+
+        with self._lock:
+            del self._pending[(n, e)]
+
+        if future.cancelled():
+            return
+
+        private: Optional[PrivateNumbers] = None
+        try:
+            private = future.result()
+        except Exception as exc:
+            print(f"Factoring integer {n} raised {exc!r}")
+
+        if private is None:
+            print(f"Failed to factors integer {n}")
+            self._set_result(n, e, "failed")
+            return
+
+        decrypt.cache.put(n, e, private)
+        self._set_result(n, e, "broken", private)
+        decrypt.print_private_numbers(private)
+
+    def _broken(self, n: int, e: int, private: PrivateNumbers) -> None:
+        """Records a key broken by batch GCD."""
+        import decrypt
+
+        print(f"Batch GCD found a prime shared by integer {n}")
+        decrypt.cache.put(n, e, private)
+        self._set_result(n, e, "broken", private)
+        decrypt.print_private_numbers(private)
+
+    def _set_result(
+        self, n: int, e: int, status: str, private: Optional[PrivateNumbers] = None
+    ) -> None:
+        """Records the factoring status of a key in the store, if there is one."""
+        if self.store is not None:
+            self.store.set_result(n, e, status, private)
@@ -1,19 +1,54 @@
 #!/usr/bin/env python3
 
+import time
+
+# Taken before the other imports, so the time to listen reported includes them
+STARTED = time.monotonic()
+
+import os
+import selectors
 import socket
 import threading
 from paramiko import Channel, PKey, RSAKey, ServerInterface, Transport
 from paramiko.common import AUTH_SUCCESSFUL, OPEN_SUCCEEDED
-from pexpect import EOF, TIMEOUT, spawn
-from threading import Thread
 from argparse import ArgumentParser, Namespace
+from typing import TYPE_CHECKING, Optional, Union
+
+from broker import JobBroker, parse_address
+from cache import FactorCache
+from jobs import FactoringScheduler
+from store import KeyStore
 
-from decrypt import decrypt_pubkey
+# pexpect and the factoring modules are imported when first used, to start quickly
+if TYPE_CHECKING:
+    from pexpect import spawn
 
 ## SSH server
 
 
 class Server(ServerInterface):
+    scheduler: FactoringScheduler
+    """Scheduler that factors the public keys we are sent."""
+    bridge: "ShellBridge"
+    """Thread that runs the shells clients open."""
+    store: Optional[KeyStore]
+    """Store to record the public keys we are sent in, if any."""
+    addr: tuple[str, int]
+    """Address of the client."""
+
+    def __init__(
+        self,
+        scheduler: FactoringScheduler,
+        bridge: "ShellBridge",
+        store: Optional[KeyStore],
+        addr: tuple[str, int],
+    ) -> None:
+        self.scheduler = scheduler
+        self.bridge = bridge
+        self.store = store
+        self.addr = addr
+        super().__init__()
+
     def check_channel_request(self, _kind: str, _chanid: int) -> int:
         """Allow any client to open a communcations channel with the server."""
         return OPEN_SUCCEEDED
@@ -24,9 +59,13 @@ class Server(ServerInterface):
         return "publickey"
 
     def check_auth_publickey(self, _username: str, key: PKey) -> int:
-        """Always accept any pubkeys - and decrypt them."""
+        """Always accept any pubkeys - record them and queue them to be decrypted."""
         if key.algorithm_name == "RSA":
-            Thread(target=decrypt_pubkey, args=[key.key]).start()
+            pubints = key.key.public_numbers()
+            if self.store is not None:
+                source = f"{self.addr[0]}:{self.addr[1]}"
+                self.store.record(key.fingerprint, pubints.n, pubints.e, source)
+            self.scheduler.submit(pubints.n, pubints.e)
         return AUTH_SUCCESSFUL
 
     def check_channel_pty_request(
@@ -45,8 +84,10 @@ class Server(ServerInterface):
 
     def check_channel_shell_request(self, channel: Channel) -> bool:
         """Opens a shell for anyone who asks."""
+        from pexpect import spawn
+
         shell = spawn("/bin/bash")
-        Shell(shell, channel).start()
+        self.bridge.add(Shell(shell, channel))
 
         return True
 
@@ -54,43 +95,280 @@ class Server(ServerInterface):
         return ("You are now using Team Cryptos very dodgy SSH server.", "en-US")
 
 
-class Shell(threading.Thread):
-    """This is a thread that runs a shell for a connected client.
-    All logic is in the run method."""
+class Shell:
+    """A shell running for a connected client.
+    All data sent down the channel is copied to the child shell.
+    Output from the shell is sent back up the channel.
+    Neither copy ever blocks: whatever the other end has no room for is buffered,
+    and reading stops while the buffer is full."""
 
-    shell: spawn
+    shell: "spawn"
     """pexpect process running a shell."""
     chan: Channel
     """A channel that is communicating with this shell."""
-
-    def __init__(self, shell: spawn, chan: Channel) -> None:
+    to_shell: bytearray
+    """Data from the channel that the shell has not taken yet."""
+    to_channel: bytearray
+    """Output of the shell that the channel has no room for yet."""
+    buffer_size: int = 1 << 18
+    """Bytes buffered toward either end before we stop reading from the other."""
+
+    def __init__(self, shell: "spawn", chan: Channel) -> None:
         self.shell = shell
         self.chan = chan
-        super().__init__()
+        self.to_shell = bytearray()
+        self.to_channel = bytearray()
+        os.set_blocking(shell.child_fd, False)
+
+    def from_channel(self) -> bool:
+        """Buffers data waiting on the channel for the shell.
+        Returns False once the channel has reached EOF."""
+        data = self.chan.recv(65536)
+        if len(data) == 0:
+            return False
+
+        self.to_shell += data
+        return True
 
-    def run(self) -> None:
-        """This method runs a shell for the connected user.
-        All data sent down the channel is copied to the child shell.
-        Output from the shell is sent back up the channel.
-        Upon reading EOF from channel, we kill process and close channel."""
-
-        while not self.chan.closed:
-            if self.chan.recv_ready():
-                self.shell.send(self.chan.recv(2048))
-            else:
-                try:
-                    self.chan.send(self.shell.read_nonblocking(2048, 0))
-                except TIMEOUT:
-                    pass
-                except EOF:
-                    break
+    def from_shell(self) -> bool:
+        """Buffers output waiting from the shell for the channel.
+        Returns False once the shell has exited."""
+        try:
+            data = os.read(self.shell.child_fd, 65536)
+        except BlockingIOError:
+            return True
+        except OSError:
+            # Reading a pty whose child has exited fails with EIO
+            return False
+
+        if len(data) == 0:
+            return False
+
+        self.to_channel += data
+        return True
 
+    def flush(self) -> None:
+        """Writes as much of both buffers as either end will take without blocking."""
+        while self.to_channel and self.chan.send_ready():
+            sent = self.chan.send(self.to_channel)
+            del self.to_channel[:sent]
+
+        if self.to_shell:
+            try:
+                written = os.write(self.shell.child_fd, self.to_shell)
+            except BlockingIOError:
+                written = 0
+            del self.to_shell[:written]
+
+    def close(self) -> None:
+        """Kills the shell and closes the channel."""
         if self.chan.active:
             self.chan.shutdown(2)
             self.chan.close()
         self.shell.kill(9)
 
 
+class ShellBridge(threading.Thread):
+    """This is a thread that runs the shells of all connected clients.
+    It sleeps until either end of any shell has data, so idle shells cost nothing,
+    and never blocks on one shell, so a client that stops reading only stalls itself.
+    All logic is in the run method."""
+
+    poll_interval: float = 0.05
+    """Seconds between retries of shells waiting for their channel's window to open,
+    which the selector cannot watch for."""
+
+    def __init__(self) -> None:
+        self._selector = selectors.DefaultSelector()
+        self._added: list[Shell] = []
+        self._blocked: set[Shell] = set()
+        self._lock = threading.Lock()
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ)
+        super().__init__(daemon=True)
+
+    def add(self, shell: Shell) -> None:
+        """Starts bridging a shell to its channel."""
+        with self._lock:
+            self._added.append(shell)
+        self._wakeup_send.send(b"\0")
+
+    def run(self) -> None:
+        """This method waits on the channels and shell processes together.
+        Upon reading EOF from either, we kill the process and close the channel."""
+        while True:
+            timeout = self.poll_interval if self._blocked else None
+            ready = set(self._blocked)
+            for key, events in self._selector.select(timeout):
+                if key.fileobj is self._wakeup_recv:
+                    self._register_added()
+                    continue
+
+                # A shell closed earlier in this batch may still have events in it
+                if key.fileobj not in self._selector.get_map():
+                    continue
+
+                shell = key.data
+                try:
+                    if events & selectors.EVENT_READ:
+                        if key.fileobj is shell.chan:
+                            alive = shell.from_channel()
+                        else:
+                            alive = shell.from_shell()
+                        if not alive:
+                            self._close(shell)
+                            ready.discard(shell)
+                            continue
+                except OSError:
+                    self._close(shell)
+                    ready.discard(shell)
+                    continue
+                ready.add(shell)
+
+            for shell in ready:
+                try:
+                    shell.flush()
+                except OSError:
+                    self._close(shell)
+                    continue
+                self._watch(shell)
+
+    def _register_added(self) -> None:
+        """Registers the shells added since the last wakeup with the selector."""
+        try:
+            while self._wakeup_recv.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        with self._lock:
+            added, self._added = self._added, []
+
+        for shell in added:
+            self._watch(shell)
+
+    def _watch(self, shell: Shell) -> None:
+        """Watches either end of a shell for the events it can handle now.
+        Reading from one end stops while the buffer toward the other is full,
+        and the shell end is watched for room while data is buffered toward it."""
+        chan_events = 0
+        if len(shell.to_shell) < shell.buffer_size:
+            chan_events |= selectors.EVENT_READ
+        self._set_events(shell.chan, chan_events, shell)
+
+        shell_events = 0
+        if len(shell.to_channel) < shell.buffer_size:
+            shell_events |= selectors.EVENT_READ
+        if shell.to_shell:
+            shell_events |= selectors.EVENT_WRITE
+        self._set_events(shell.shell.child_fd, shell_events, shell)
+
+        if shell.to_channel:
+            self._blocked.add(shell)
+        else:
+            self._blocked.discard(shell)
+
+    def _set_events(
+        self, fileobj: Union[Channel, int], events: int, shell: Shell
+    ) -> None:
+        """Registers, modifies or unregisters a file with the selector."""
+        key = self._selector.get_map().get(fileobj)
+        if key is None:
+            if events:
+                self._selector.register(fileobj, events, shell)
+        elif not events:
+            self._selector.unregister(fileobj)
+        elif key.events != events:
+            self._selector.modify(fileobj, events, shell)
+
+    def _close(self, shell: Shell) -> None:
+        """Stops bridging a shell, then kills it and closes its channel."""
+        self._set_events(shell.chan, 0, shell)
+        self._set_events(shell.shell.child_fd, 0, shell)
+        self._blocked.discard(shell)
+        shell.close()
+
+
+class Connection(threading.Thread):
+    """This is a thread that serves one connected client.
+    All logic is in the run method."""
+
+    client: socket.socket
+    """Socket connected to the client."""
+    addr: tuple[str, int]
+    """Address of the client."""
+    privkey: PKey
+    """Host key to identify the server with."""
+    scheduler: FactoringScheduler
+    """Scheduler that factors the public keys we are sent."""
+    bridge: ShellBridge
+    """Thread that runs the shells clients open."""
+    store: Optional[KeyStore]
+    """Store to record the public keys we are sent in, if any."""
+    slots: threading.BoundedSemaphore
+    """Connection slot held by this thread, released when it finishes."""
+
+    def __init__(
+        self,
+        client: socket.socket,
+        addr: tuple[str, int],
+        privkey: PKey,
+        scheduler: FactoringScheduler,
+        bridge: ShellBridge,
+        store: Optional[KeyStore],
+        slots: threading.BoundedSemaphore,
+    ) -> None:
+        self.client = client
+        self.addr = addr
+        self.privkey = privkey
+        self.scheduler = scheduler
+        self.bridge = bridge
+        self.store = store
+        self.slots = slots
+        super().__init__(daemon=True)
+
+    def run(self) -> None:
+        """This method negotiates SSH with the client and waits
+        until its session channel closes, then hangs up."""
+        try:
+            with Transport(sock=self.client) as tsp:
+                event = threading.Event()
+
+                tsp.add_server_key(self.privkey)
+                tsp.start_server(
+                    server=Server(self.scheduler, self.bridge, self.store, self.addr),
+                    event=event,
+                )
+
+                channel = tsp.accept(20)
+                if channel is None:
+                    return
+
+                # The status event is also set when the channel closes
+                while not channel.closed:
+                    channel.status_event.wait(1)
+        except Exception as exc:
+            print(f"Connection from {self.addr} failed: {exc!r}")
+        finally:
+            self.client.close()
+            self.slots.release()
+
+
+## Host key
+
+
+def load_host_key(path: str) -> RSAKey:
+    """Loads the host key persisted at path, generating and saving it on first use,
+    so restarts are quick and clients see the same host key every time."""
+    if os.path.exists(path):
+        return RSAKey.from_private_key_file(path)
+
+    key = RSAKey.generate(2048)
+    key.write_private_key_file(path)
+    return key
+
+
 ## CLI
 
 
@@ -114,18 +392,128 @@ def parse_args() -> Namespace:
         help="Path to a PEM encoded RSA private key to use as the identity of the server.",
     )
 
-    return parser.parse_args()
+    parser.add_argument(
+        "-K",
+        "--host-key",
+        required=False,
+        help="Path to persist the identity of the server at. A key is generated"
+        + " there on the first start and reused afterwards.",
+    )
+
+    parser.add_argument(
+        "-c",
+        "--factor-cache",
+        required=False,
+        help="Path of a file to persist the private numbers of broken keys in."
+        + " By default they are only cached in memory.",
+    )
+
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        required=False,
+        help="Number of processes factoring public keys. Default is the number of CPUs.",
+    )
+
+    parser.add_argument(
+        "-q",
+        "--queue-size",
+        type=int,
+        default=64,
+        help="Maximum number of public keys waiting to be factored."
+        + " Keys are dropped while it is full. Default is 64.",
+    )
+
+    parser.add_argument(
+        "-b",
+        "--backlog",
+        type=int,
+        default=128,
+        help="Number of pending connections the OS may queue. Default is 128.",
+    )
+
+    parser.add_argument(
+        "-m",
+        "--max-connections",
+        type=int,
+        default=512,
+        help="Number of clients served at once."
+        + " Further clients wait in the backlog. Default is 512.",
+    )
+
+    parser.add_argument(
+        "-g",
+        "--batch-gcd-interval",
+        type=float,
+        default=60.0,
+        help="Seconds between batch GCD runs across every public key seen."
+        + " Default is 60.",
+    )
+
+    parser.add_argument(
+        "-s",
+        "--key-store",
+        required=False,
+        help="Path of an SQLite database to record every public key received in.",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--broker",
+        required=False,
+        help="host:port to publish factoring jobs on for worker.py processes,"
+        + " instead of factoring keys in local processes.",
+    )
+
+    parser.add_argument(
+        "--broker-key",
+        required=False,
+        help="Secret workers must present to the broker. Required with --broker.",
+    )
+
+    args = parser.parse_args()
+    if args.broker is not None and args.broker_key is None:
+        parser.error("--broker requires --broker-key")
+    if args.private_key is not None and args.host_key is not None:
+        parser.error("--private-key and --host-key are mutually exclusive")
+
+    return args
 
 
 if __name__ == "__main__":
     args = parse_args()
 
     port = int(args.port) if args.port is not None else 2222
+    if args.factor_cache is not None:
+        import decrypt
+
+        decrypt.cache = FactorCache(args.factor_cache)
+    store = None
+    if args.key_store is not None:
+        store = KeyStore(args.key_store)
+        store.start()
+
+    broker = None
+    if args.broker is not None:
+        broker = JobBroker(parse_address(args.broker), args.broker_key.encode())
+        broker.start()
+        print(f"Publishing factoring jobs on {broker.address}")
+
+    scheduler = FactoringScheduler(
+        args.workers, args.queue_size, args.batch_gcd_interval, store, broker
+    )
+
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     sock.bind(("0.0.0.0", port))
 
-    if args.private_key is None:
+    if args.host_key is not None:
+        generated = not os.path.exists(args.host_key)
+        privkey = load_host_key(args.host_key)
+        action = "newly generated and saved" if generated else "saved"
+        privkey_source = f"{action} at {args.host_key}"
+    elif args.private_key is None:
         privkey = RSAKey.generate(2048)
         privkey_source = "that was newly generated."
     else:
@@ -134,21 +522,17 @@ if __name__ == "__main__":
 
     print(f"Serving the server on port {port} using a private key {privkey_source}")
 
+    bridge = ShellBridge()
+    bridge.start()
+
+    sock.listen(args.backlog)
+    print(f"Listening {time.monotonic() - STARTED:.3f} seconds after startup")
+
+    slots = threading.BoundedSemaphore(args.max_connections)
     while True:
-        sock.listen(5)
+        # Stop accepting while every slot is taken, so excess clients queue in the backlog
+        slots.acquire()
         client, addr = sock.accept()
         print(f"Client connected from {addr}")
 
-        server = Server()
-        with Transport(sock=client) as tsp:
-            event = threading.Event()
-
-            tsp.add_server_key(privkey)
-            tsp.start_server(server=server, event=event)
-
-            channel = tsp.accept(20)
-            if channel is None:
-                continue
-
-            while not channel.closed:
-                ...
+        Connection(client, addr, privkey, scheduler, bridge, store, slots).start()
@@ -2,9 +2,24 @@
 
 """shors.py: Shor's algorithm for quantum integer factorization"""
 
+import cmath
 import math
+import os
 import random
+import shutil
+import tempfile
+import time
 import argparse
+import bisect
+import itertools
+import multiprocessing
+import queue
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 __author__ = "Todd Wildey"
 __copyright__ = "Copyright 2013"
@@ -34,256 +49,821 @@ printInfo = printVerbose
 ####################################################################################################
 
 
-class Mapping:
-    def __init__(self, state, amplitude):
-        self.state = state
-        self.amplitude = amplitude
+# Two-register model for the object backend: amplitudes are a list of complex
+# numbers that the transforms update in place, and entanglement with another
+# register is a list of states, so state x of the source register is entangled with
+# state indices[x] of this one. Needs no numpy and O(Q) memory
+class CompactRegister:
+    def __init__(self, numBits):
+        self.numBits = numBits
+        self.numStates = 1 << numBits
+        self.source = None
+        self.entangled = []
+        self.vector = [complex(0.0)] * self.numStates
+        self.vector[0] = complex(1.0)
+        self.support = [0]
+        self.cumulative = None
+
+    def checkUnentangled(self):
+        if self.source is not None or self.entangled:
+            raise ValueError("Cannot transform an entangled register")
+
+    # Every change to the amplitudes drops the cached distribution of a measurement,
+    # and the states that may be non-zero unless they are known
+    def changed(self, support=None):
+        self.support = support
+        self.cumulative = None
+
+    # In-place fast Walsh-Hadamard transform, taking state x to the sum over y of
+    # (-1)^popcount(x & y) |y> / sqrt(Q)
+    def hadamard(self):
+        self.checkUnentangled()
+        self.changed()
+
+        vector = self.vector
+        Q = self.numStates
+        scale = 1.0 / math.sqrt(Q)
+        if not any(vector[1:]):
+            amplitude = vector[0] * scale
+            for x in range(Q):
+                vector[x] = amplitude
+            return
+
+        half = 1
+        while half < Q:
+            for start in range(0, Q, 2 * half):
+                for x in range(start, start + half):
+                    low, high = vector[x], vector[x + half]
+                    vector[x] = low + high
+                    vector[x + half] = low - high
+            half <<= 1
+
+        for x in range(Q):
+            vector[x] *= scale
+
+    # In-place radix-2 FFT with the e^(-2 pi i xy / Q) kernel of the QFT
+    def qft(self):
+        self.checkUnentangled()
+        self.changed()
+
+        vector = self.vector
+        Q = self.numStates
+
+        # Bit-reversal permutation
+        j = 0
+        for i in range(1, Q):
+            bit = Q >> 1
+            while j & bit:
+                j ^= bit
+                bit >>= 1
+            j |= bit
+            if i < j:
+                vector[i], vector[j] = vector[j], vector[i]
+
+        k = -2.0 * math.pi / Q
+        twiddles = [cmath.exp(complex(0.0, k * y)) for y in range(Q // 2)]
+        size = 2
+        while size <= Q:
+            half = size // 2
+            stride = Q // size
+            for start in range(0, Q, size):
+                for y in range(half):
+                    low = vector[start + y]
+                    high = vector[start + y + half] * twiddles[y * stride]
+                    vector[start + y] = low + high
+                    vector[start + y + half] = low - high
+            size <<= 1
+
+        scale = 1.0 / math.sqrt(Q)
+        for x in range(Q):
+            vector[x] *= scale
+
+    # Entangle toRegister with this register, where function maps a range of states
+    # [start, stop) of this register to the list of states of toRegister
+    def map(self, toRegister, function):
+        toRegister.source = (self, list(function(0, self.numStates)))
+        toRegister.cumulative = None
+        self.entangled.append(toRegister)
+
+    def probabilities(self):
+        if self.source is None:
+            return [
+                (amplitude * amplitude.conjugate()).real for amplitude in self.vector
+            ]
+
+        register, indices = self.source
+        probabilities = [0.0] * self.numStates
+        for y, probability in zip(indices, register.probabilities()):
+            probabilities[y] += probability
+
+        return probabilities
+
+    # Inverse transform sampling by bisecting the cumulative distribution, which is
+    # built once and kept until the register changes
+    def measure(self):
+        if self.cumulative is None:
+            self.cumulative = list(itertools.accumulate(self.probabilities()))
+
+        finalX = bisect.bisect_right(self.cumulative, random.random())
+        if finalX >= self.numStates:
+            return None
+
+        # Collapse the register we are entangled from onto the states mapping to finalX
+        if self.source is not None:
+            register, indices = self.source
+            register.collapse(indices, finalX)
+            register.entangled.remove(self)
+            self.source = None
+
+        # Collapse the registers entangled from us onto the image of finalX
+        for register in self.entangled:
+            _, indices = register.source
+            register.setBasis(indices[finalX])
+            register.source = None
+        self.entangled = []
 
+        self.setBasis(finalX)
 
-class QuantumState:
-    def __init__(self, amplitude, register):
-        self.amplitude = amplitude
-        self.register = register
-        self.entangled = {}
+        return finalX
 
-    def entangle(self, fromState, amplitude):
-        register = fromState.register
-        entanglement = Mapping(fromState, amplitude)
+    # Keep only the states whose index is y, renormalised. list.index finds them, so
+    # only the O(Q/r) matching states are visited in Python
+    def collapse(self, indices, y):
+        states = []
+        x = -1
         try:
-            self.entangled[register].append(entanglement)
-        except KeyError:
-            self.entangled[register] = [entanglement]
+            while True:
+                x = indices.index(y, x + 1)
+                states.append(x)
+        except ValueError:
+            pass
+
+        amplitudes = [self.vector[x] for x in states]
+        sumProb = sum(
+            (amplitude * amplitude.conjugate()).real for amplitude in amplitudes
+        )
+        scale = 1.0 / math.sqrt(sumProb)
+
+        self.clear()
+        for x, amplitude in zip(states, amplitudes):
+            self.vector[x] = amplitude * scale
+        self.changed(states)
+
+    def setBasis(self, x):
+        self.clear()
+        self.vector[x] = complex(1.0)
+        self.changed([x])
+
+    # Zero every amplitude, only visiting the states that may be non-zero if they are
+    # known and otherwise starting from a fresh list
+    def clear(self):
+        if self.support is None:
+            self.vector = [complex(0.0)] * self.numStates
+            return
+
+        for x in self.support:
+            self.vector[x] = complex(0.0)
 
     def entangles(self, register=None):
-        entangles = 0
-        if register is None:
-            for states in self.entangled.values():
-                entangles += len(states)
-        else:
-            entangles = len(self.entangled[register])
+        entangles = 0 if self.source is None else len(self.source[1])
+        for register in self.entangled:
+            entangles += len(register.source[1])
 
         return entangles
 
+    def amplitudes(self):
+        if self.source is None:
+            return list(self.vector)
 
-class QubitRegister:
-    def __init__(self, numBits):
+        # An entangled register has no pure state of its own, report its reduced one
+        return [complex(math.sqrt(p)) for p in self.probabilities()]
+
+
+# States per block when streaming a memory-mapped register, 4 MiB of amplitudes
+BLOCK_STATES = 1 << 18
+
+# Directory for the files of memory-mapped registers, None for the system default
+MMAP_DIRECTORY = None
+
+
+# State-vector counterpart of CompactRegister: amplitudes live in a single complex128
+# array and entanglement with another register is held as an index array, so
+# state x of the source register is entangled with state indices[x] of this one
+class VectorRegister:
+    def __init__(self, numBits, blockSize=None):
         self.numBits = numBits
         self.numStates = 1 << numBits
+        self.blockSize = self.numStates if blockSize is None else blockSize
+        self.blockSize = min(self.blockSize, self.numStates)
+        self.source = None
         self.entangled = []
-        self.states = [QuantumState(complex(0.0), self) for x in range(self.numStates)]
-        self.states[0].amplitude = complex(1.0)
-
-    def propagate(self, fromRegister=None):
-        if fromRegister is not None:
-            for state in self.states:
-                amplitude = complex(0.0)
-
-                try:
-                    entangles = state.entangled[fromRegister]
-                    for entangle in entangles:
-                        amplitude += entangle.state.amplitude * entangle.amplitude
+        self.vector = self.allocate(np.complex128)
+        self.vector[0] = 1.0
+        self.support = [0]
+        self.cumulative = None
+
+    # Zeroed array of one value per state, which subclasses may keep out of memory
+    def allocate(self, dtype):
+        return np.zeros(self.numStates, dtype=dtype)
+
+    # Every operation walks the register in these slices, so only one block of
+    # temporaries is alive at a time. In memory the whole register is one block
+    def blocks(self):
+        for start in range(0, self.numStates, self.blockSize):
+            yield slice(start, min(start + self.blockSize, self.numStates))
+
+    # Index arrays can only describe a basis-state mapping, so unitaries are applied
+    # to registers that are not entangled
+    def checkUnentangled(self):
+        if self.source is not None or self.entangled:
+            raise ValueError("Cannot transform an entangled register")
+
+    # Every change to the amplitudes drops the cached distribution of a measurement,
+    # and the states that may be non-zero unless they are known
+    def changed(self, support=None):
+        self.support = support
+        self.cumulative = None
+
+    # Fast Walsh-Hadamard transform in O(Q log Q), with an O(Q) shortcut for |0>,
+    # giving the same amplitudes as CompactRegister.hadamard
+    def hadamard(self):
+        self.checkUnentangled()
+        self.changed()
+
+        vector = self.vector
+        scale = 1.0 / math.sqrt(self.numStates)
+        if not any(vector[max(s.start, 1) : s.stop].any() for s in self.blocks()):
+            amplitude = vector[0] * scale
+            for s in self.blocks():
+                vector[s] = amplitude
+            return
+
+        # Butterflies within each block
+        for s in self.blocks():
+            block = vector[s]
+            half = 1
+            while half < len(block):
+                pairs = block.reshape(-1, 2, half)
+                low = pairs[:, 0, :].copy()
+                pairs[:, 0, :] += pairs[:, 1, :]
+                pairs[:, 1, :] = low - pairs[:, 1, :]
+                half <<= 1
+
+        # Butterflies between blocks, one pair of blocks at a time
+        size = self.blockSize
+        half = size
+        while half < self.numStates:
+            for start in range(0, self.numStates, 2 * half):
+                for low in range(start, start + half, size):
+                    high = low + half
+                    lowBlock = vector[low : low + size].copy()
+                    vector[low : low + size] += vector[high : high + size]
+                    vector[high : high + size] = lowBlock - vector[high : high + size]
+            half <<= 1
+
+        for s in self.blocks():
+            vector[s] *= scale
+
+    # Quantum Fourier transform of the amplitude vector in O(Q log Q); numpy's forward
+    # FFT uses the same e^(-2 pi i xy / Q) kernel as CompactRegister.qft
+    def qft(self):
+        self.checkUnentangled()
+        self.changed()
+
+        if self.blockSize == self.numStates:
+            self.vector = np.fft.fft(self.vector, norm="ortho")
+            return
+
+        # Four-step FFT: view the vector as a rows x columns matrix, transform the
+        # columns, apply twiddle factors, then transform the rows into transposed order
+        Q = self.numStates
+        rows = 1 << ((self.numBits + 1) // 2)
+        columns = Q // rows
+        matrix = self.vector.reshape(rows, columns)
+        output = self.allocate(np.complex128)
+        transposed = output.reshape(columns, rows)
+
+        k = np.arange(rows, dtype=np.int64).reshape(rows, 1)
+        width = max(1, self.blockSize // rows)
+        for start in range(0, columns, width):
+            n = np.arange(start, min(start + width, columns), dtype=np.int64)
+            block = np.fft.fft(matrix[:, start : start + width], axis=0, norm="ortho")
+            block *= np.exp((-2j * math.pi / Q) * ((k * n) % Q))
+            matrix[:, start : start + width] = block
+
+        height = max(1, self.blockSize // columns)
+        for start in range(0, rows, height):
+            block = np.fft.fft(matrix[start : start + height], axis=1, norm="ortho")
+            transposed[:, start : start + height] = block.T
+
+        self.vector = output
+
+    # Entangle toRegister with this register, where function maps a range of states
+    # [start, stop) of this register to the array of states of toRegister
+    def map(self, toRegister, function):
+        indices = self.allocate(np.int64)
+        for s in self.blocks():
+            indices[s] = function(s.start, s.stop)
+        toRegister.source = (self, indices)
+        toRegister.cumulative = None
+        self.entangled.append(toRegister)
 
-                    state.amplitude = amplitude
-                except KeyError:
-                    state.amplitude = amplitude
+    # Yields (start, probabilities) for consecutive blocks of states
+    def probabilityBlocks(self):
+        if self.source is None:
+            for s in self.blocks():
+                amplitudes = self.vector[s]
+                yield s.start, (amplitudes * amplitudes.conjugate()).real
+            return
+
+        register, indices = self.source
+        probabilities = np.zeros(self.numStates)
+        for start, probs in register.probabilityBlocks():
+            probabilities += np.bincount(
+                indices[start : start + len(probs)],
+                weights=probs,
+                minlength=self.numStates,
+            )
+        yield 0, probabilities
+
+    def probabilities(self):
+        return np.concatenate([probs for _, probs in self.probabilityBlocks()])
+
+    # Cumulative distribution of a measurement, built a block at a time into an array
+    # of its own and kept until the register changes
+    def cumulativeProbabilities(self):
+        if self.cumulative is None:
+            cumulative = self.allocate(np.float64)
+            sumProb = 0.0
+            for start, probs in self.probabilityBlocks():
+                block = cumulative[start : start + len(probs)]
+                np.cumsum(probs, out=block)
+                block += sumProb
+                sumProb = block[-1]
+            self.cumulative = cumulative
+
+        return self.cumulative
 
+    def measure(self):
+        cumulative = self.cumulativeProbabilities()
+        finalX = int(np.searchsorted(cumulative, random.random(), side="right"))
+        if finalX >= self.numStates:
+            return None
+
+        # Collapse the register we are entangled from onto the states mapping to finalX
+        if self.source is not None:
+            register, indices = self.source
+            register.collapse(indices, finalX)
+            register.entangled.remove(self)
+            self.source = None
+
+        # Collapse the registers entangled from us onto the image of finalX
         for register in self.entangled:
-            if register is fromRegister:
-                continue
+            _, indices = register.source
+            register.setBasis(int(indices[finalX]))
+            register.source = None
+        self.entangled = []
 
-            register.propagate(self)
+        self.setBasis(finalX)
 
-    # Map will convert any mapping to a unitary tensor given each element v
-    # returned by the mapping has the property v * v.conjugate() = 1
-    #
-    def map(self, toRegister, mapping, propagate=True):
-        self.entangled.append(toRegister)
-        toRegister.entangled.append(self)
-
-        # Create the covariant/contravariant representations
-        mapTensorX = {}
-        mapTensorY = {}
-        for x in range(self.numStates):
-            mapTensorX[x] = {}
-            codomain = mapping(x)
-            for element in codomain:
-                y = element.state
-                mapTensorX[x][y] = element
-
-                try:
-                    mapTensorY[y][x] = element
-                except KeyError:
-                    mapTensorY[y] = {x: element}
-
-        # Normalize the mapping:
-        def normalize(tensor, p=False):
-            lSqrt = math.sqrt
-            for vectors in tensor.values():
-                sumProb = 0.0
-                for element in vectors.values():
-                    amplitude = element.amplitude
-                    sumProb += (amplitude * amplitude.conjugate()).real
-
-                normalized = lSqrt(sumProb)
-                for element in vectors.values():
-                    element.amplitude = element.amplitude / normalized
-
-        normalize(mapTensorX)
-        normalize(mapTensorY, True)
-
-        # Entangle the registers
-        for x, yStates in mapTensorX.items():
-            for y, element in yStates.items():
-                amplitude = element.amplitude
-                toState = toRegister.states[y]
-                fromState = self.states[x]
-                toState.entangle(fromState, amplitude)
-                fromState.entangle(toState, amplitude.conjugate())
-
-        if propagate:
-            toRegister.propagate(self)
+        return finalX
 
-    def measure(self):
-        measure = random.random()
-        sumProb = 0.0
+    # Keep only the states whose index is y, renormalised, writing just those O(Q/r)
+    # states into a cleared register
+    def collapse(self, indices, y):
+        states = [s.start + np.flatnonzero(indices[s] == y) for s in self.blocks()]
+        states = np.concatenate(states)
 
-        # Pick a state
-        finalX = None
-        finalState = None
-        for x, state in enumerate(self.states):
-            amplitude = state.amplitude
-            sumProb += (amplitude * amplitude.conjugate()).real
+        amplitudes = self.vector[states]
+        amplitudes /= math.sqrt(np.vdot(amplitudes, amplitudes).real)
 
-            if sumProb > measure:
-                finalState = state
-                finalX = x
-                break
+        self.clear()
+        self.vector[states] = amplitudes
+        self.changed(states)
 
-        # If state was found, update the system
-        if finalState is not None:
-            for state in self.states:
-                state.amplitude = complex(0.0)
+    def setBasis(self, x):
+        self.clear()
+        self.vector[x] = 1.0
+        self.changed([x])
 
-            finalState.amplitude = complex(1.0)
-            self.propagate()
+    # Zero every amplitude, only visiting the states that may be non-zero if they are
+    # known and otherwise allocating a fresh array, whose zeroed pages the kernel
+    # provides on first touch
+    def clear(self):
+        if self.support is None:
+            self.vector = self.allocate(np.complex128)
+            return
 
-        return finalX
+        self.vector[self.support] = 0.0
 
     def entangles(self, register=None):
-        entangles = 0
-        for state in self.states:
-            entangles += state.entangles(None)
+        entangles = 0 if self.source is None else len(self.source[1])
+        for register in self.entangled:
+            entangles += len(register.source[1])
 
         return entangles
 
     def amplitudes(self):
-        amplitudes = []
-        for state in self.states:
-            amplitudes.append(state.amplitude)
+        if self.source is None:
+            return list(self.vector)
+
+        # An entangled register has no pure state of its own, report its reduced one
+        return list(np.sqrt(self.probabilities()).astype(np.complex128))
+
+
+# VectorRegister whose amplitudes and index arrays live in memory-mapped temporary
+# files, so registers larger than memory are streamed through it a block at a time.
+# The files are unlinked on creation and freed once their arrays are dropped
+class MappedRegister(VectorRegister):
+    def __init__(self, numBits, directory=None, blockSize=None):
+        self.directory = directory
+        super().__init__(numBits, BLOCK_STATES if blockSize is None else blockSize)
+
+    def allocate(self, dtype):
+        size = self.numStates * np.dtype(dtype).itemsize
+        with tempfile.TemporaryFile(dir=self.directory) as handle:
+            handle.truncate(size)
+            return np.memmap(handle, dtype=dtype, mode="r+", shape=(self.numStates,))
+
+
+# Inverse transform sampling over (start, probabilities) blocks, without ever holding
+# more than one block of the cumulative distribution
+def sampleBlocks(blocks):
+    measure = random.random()
+    sumProb = 0.0
+    for start, probs in blocks:
+        cumulative = sumProb + np.cumsum(probs)
+        x = int(np.searchsorted(cumulative, measure, side="right"))
+        if x < len(probs):
+            return start + x
+        sumProb = cumulative[-1]
 
-        return amplitudes
+    return None
 
 
-def printEntangles(register):
-    printInfo("Entagles: " + str(register.entangles()))
+# Deferred measurement: once the output register reads y, the input register is the
+# uniform superposition over {x : a^x mod N = y}, which is built in blocks so only
+# the O(Q/r) matching states are ever held
+def qModExpPreimage(table, y, Q, blockSize=1 << 16):
+    states = []
+    for start in range(0, Q, blockSize):
+        values = table.range(start, min(start + blockSize, Q))
+        states.append(start + np.flatnonzero(values == y))
+
+    return np.concatenate(states)
+
+
+# Measure the QFT of the uniform superposition over an arithmetic progression of
+# states. The probabilities have the closed form sin^2(M theta) / (M Q sin^2 theta)
+# with theta = pi * step * c / Q, so they are streamed in blocks of c
+def qftProgressionMeasure(states, Q, blockSize=1 << 16):
+    count = len(states)
+    step = int(states[1] - states[0]) if count > 1 else Q
+
+    def probabilityBlocks():
+        for start in range(0, Q, blockSize):
+            c = np.arange(start, min(start + blockSize, Q), dtype=np.int64)
+            yield start, progressionProbabilities(c, count, step, Q)
+
+    return sampleBlocks(probabilityBlocks())
+
+
+def progressionProbabilities(c, count, step, Q):
+    theta = (math.pi / Q) * ((c * step) % Q)
+    denominator = np.sin(theta)
+    periodic = np.abs(denominator) < 1e-12
+    denominator[periodic] = 1.0
+    probs = np.sin(count * theta) ** 2 / (count * Q * denominator**2)
+    probs[periodic] = count / float(Q)
+    return probs
+
+
+# Distribution of the QFT register's measurement for one a and N. The output register
+# reads y with probability M_y / Q, where M_y is the number of x with a^x mod N = y,
+# leaving the input register in a progression of M_y states whose step is the number
+# of distinct outputs. The QFT of a progression only depends on its length and step,
+# so the distribution is a mix of at most two closed forms, held as a cumulative
+# array that is sampled in O(log Q)
+class QftDistribution:
+    def __init__(self, table, Q, blockSize=1 << 16):
+        self.numStates = Q
+
+        counts = np.zeros(table.N, dtype=np.int64)
+        for start in range(0, Q, blockSize):
+            values = table.range(start, min(start + blockSize, Q))
+            counts += np.bincount(values, minlength=table.N)
+        step = int(np.count_nonzero(counts))
+        lengths, outputs = np.unique(counts[counts > 0], return_counts=True)
+
+        self.cumulative = np.empty(Q)
+        sumProb = 0.0
+        for start in range(0, Q, blockSize):
+            c = np.arange(start, min(start + blockSize, Q), dtype=np.int64)
+            probs = np.zeros(len(c))
+            for count, numOutputs in zip(lengths.tolist(), outputs.tolist()):
+                weight = numOutputs * count / float(Q)
+                probs += weight * progressionProbabilities(c, count, step, Q)
 
+            cumulative = sumProb + np.cumsum(probs)
+            self.cumulative[start : start + len(c)] = cumulative
+            sumProb = cumulative[-1]
 
-def printAmplitudes(register):
-    amplitudes = register.amplitudes()
-    for x, amplitude in enumerate(amplitudes):
-        printInfo("State #" + str(x) + "'s amplitude: " + str(amplitude))
+    def sample(self):
+        x = int(np.searchsorted(self.cumulative, random.random(), side="right"))
+        if x >= self.numStates:
+            return None
 
+        return x
 
-def hadamard(x, Q):
-    codomain = []
-    for y in range(Q):
-        amplitude = complex(pow(-1.0, bitCount(x & y) & 1))
-        codomain.append(Mapping(y, amplitude))
 
-    return codomain
+# LRU cache of QftDistributions keyed by (a, N), bounded by the total number of
+# states they hold, so repeated attempts on the same a sample without re-simulating
+class DistributionCache:
+    def __init__(self, maxStates):
+        self.maxStates = maxStates
+        self.numStates = 0
+        self.distributions = OrderedDict()
 
+    def fits(self, Q):
+        return Q <= self.maxStates
 
-# Quantum Modular Exponentiation
-def qModExp(a, exp, mod):
-    state = modExp(a, exp, mod)
-    amplitude = complex(1.0)
-    return [Mapping(state, amplitude)]
+    def get(self, a, N):
+        distribution = self.distributions.get((a, N))
+        if distribution is not None:
+            self.distributions.move_to_end((a, N))
 
+        return distribution
 
-# Quantum Fourier Transform
-def qft(x, Q):
-    fQ = float(Q)
-    k = -2.0 * math.pi
-    codomain = []
+    def put(self, a, N, distribution):
+        if not self.fits(distribution.numStates) or (a, N) in self.distributions:
+            return
 
-    for y in range(Q):
-        theta = (k * float((x * y) % Q)) / fQ
-        amplitude = complex(math.cos(theta), math.sin(theta))
-        codomain.append(Mapping(y, amplitude))
+        self.distributions[(a, N)] = distribution
+        self.numStates += distribution.numStates
+        while self.numStates > self.maxStates:
+            _, evicted = self.distributions.popitem(last=False)
+            self.numStates -= evicted.numStates
 
-    return codomain
 
+# 128 MiB of cumulative probabilities
+DISTRIBUTION_CACHE_STATES = 1 << 24
 
-def findPeriod(a, N):
-    nNumBits = N.bit_length()
-    inputNumBits = (2 * nNumBits) - 1
-    inputNumBits += 1 if ((1 << inputNumBits) < (N * N)) else 0
+distributionCache = DistributionCache(DISTRIBUTION_CACHE_STATES)
+
+
+# Stage instrumentation. When set to a callable, findPeriod and attemptPeriod call
+# instrument(event, stage, info) with event "start" or "end" around each stage, where
+# info holds the number of states and entanglements of every register in use and, at
+# the end, the seconds the stage took and any value it measured or found
+instrument = None
+
+
+def stageStart(stage, registers):
+    if instrument is None:
+        return None
+
+    instrument("start", stage, registerInfo(registers))
+    return time.perf_counter()
+
+
+def stageEnd(stage, started, registers, **info):
+    if instrument is None:
+        return
+
+    seconds = time.perf_counter() - started
+    info.update(registerInfo(registers))
+    info["seconds"] = seconds
+    instrument("end", stage, info)
+
+
+def registerInfo(registers):
+    info = {}
+    for name, register in registers.items():
+        info[name] = {"states": register.numStates, "entangles": register.entangles()}
+
+    return info
+
+
+BACKENDS = ("object", "vector", "mmap", "sparse", "iterative")
+DEFAULT_BACKEND = "object" if np is None else "vector"
+
+
+# Simulates one measurement of the period-finding circuit for a and N and returns the
+# candidate period continued fractions give for it
+def findPeriod(a, N, backend=DEFAULT_BACKEND, table=None, cached=True):
+    if table is None:
+        table = ModExpTable(a, N)
+
+    x, Q = measurePeriod(table, backend, cached)
+    if x is None:
+        return None
+
+    printInfo("Finding the period via continued fractions")
+
+    started = stageStart("continued fractions", {})
+    r = cf(x, Q, N)
+    stageEnd("continued fractions", started, {}, value=r)
+
+    printInfo("Candidate period\tr = " + str(r))
+
+    return r
+
+
+# Simulates one run of the period-finding circuit for the a and N of table and returns
+# the measurement of the QFT register and Q. With cached set, a and N whose
+# distribution is in distributionCache are sampled from it instead
+def measurePeriod(table, backend=DEFAULT_BACKEND, cached=True):
+    if backend not in BACKENDS:
+        raise ValueError("Unknown backend: " + str(backend))
+    if backend != "object" and np is None:
+        raise ImportError("The " + backend + " backend requires numpy")
+
+    a = table.a
+    N = table.N
+    inputNumBits = inputBits(N)
     Q = 1 << inputNumBits
 
     printInfo("Finding the period...")
     printInfo("Q = " + str(Q) + "\ta = " + str(a))
 
-    inputRegister = QubitRegister(inputNumBits)
-    hmdInputRegister = QubitRegister(inputNumBits)
-    qftInputRegister = QubitRegister(inputNumBits)
-    outputRegister = QubitRegister(inputNumBits)
+    cached = cached and cacheable(backend, Q)
+    distribution = distributionCache.get(a, N) if cached else None
+
+    outputNumBits = N.bit_length()
+    if distribution is not None:
+        printInfo("Sampling the cached distribution of the QFT register")
+
+        started = stageStart("measure qft", {})
+        x = distribution.sample()
+        stageEnd("measure qft", started, {}, value=x)
+    elif backend == "sparse":
+        x = findPeriodSparse(table, Q)
+    elif backend == "iterative":
+        x = findPeriodIterative(table, inputNumBits)
+    elif backend == "vector":
+        inputRegister = VectorRegister(inputNumBits)
+        x = findPeriodRegisters(table, inputRegister, VectorRegister(outputNumBits))
+    elif backend == "mmap":
+        inputRegister = MappedRegister(inputNumBits, MMAP_DIRECTORY)
+        x = findPeriodRegisters(table, inputRegister, VectorRegister(outputNumBits))
+    else:
+        inputRegister = CompactRegister(inputNumBits)
+        x = findPeriodRegisters(table, inputRegister, CompactRegister(outputNumBits))
+
+    return x, Q
+
+
+# Number of qubits of the input register for N, the smallest with Q >= N^2
+def inputBits(N):
+    inputNumBits = (2 * N.bit_length()) - 1
+    inputNumBits += 1 if ((1 << inputNumBits) < (N * N)) else 0
+    return inputNumBits
+
+
+# Building a distribution costs O(Q), more than an iterative simulation does
+def cacheable(backend, Q):
+    return backend != "iterative" and np is not None and distributionCache.fits(Q)
+
+
+# Builds the distribution of the QFT register's measurement for the a and N of table
+# into distributionCache. Only worth it once a is known to be measured again
+def cacheDistribution(table, backend):
+    Q = 1 << inputBits(table.N)
+    if not cacheable(backend, Q) or distributionCache.get(table.a, table.N):
+        return
+
+    printInfo("Caching the distribution of the QFT register")
+    distributionCache.put(table.a, table.N, QftDistribution(table, Q))
+
+
+# Runs the circuit on an input and an output register that apply their transforms in
+# place, so the input register is the only copy of the 2^inputNumBits states
+def findPeriodRegisters(table, inputRegister, outputRegister):
+    registers = {"input": inputRegister, "output": outputRegister}
 
     printInfo("Registers generated")
     printInfo("Performing Hadamard on input register")
 
-    inputRegister.map(hmdInputRegister, lambda x: hadamard(x, Q), False)
-    # inputRegister.hadamard(False)
+    started = stageStart("hadamard", registers)
+    inputRegister.hadamard()
+    stageEnd("hadamard", started, registers)
 
     printInfo("Hadamard complete")
     printInfo("Mapping input register to output register, where f(x) is a^x mod N")
 
-    hmdInputRegister.map(outputRegister, lambda x: qModExp(a, x, N), False)
+    started = stageStart("modexp", registers)
+    inputRegister.map(outputRegister, table.range)
+    stageEnd("modexp", started, registers)
 
     printInfo("Modular exponentiation complete")
-    printInfo("Performing quantum Fourier transform on output register")
-
-    hmdInputRegister.map(qftInputRegister, lambda x: qft(x, Q), False)
-    inputRegister.propagate()
 
-    printInfo("Quantum Fourier transform complete")
+    # The measurement on the output register commutes with the QFT on the input
+    # register, so measure first and transform the collapsed, unentangled input
     printInfo("Performing a measurement on the output register")
 
+    started = stageStart("measure output", registers)
     y = outputRegister.measure()
+    stageEnd("measure output", started, registers, value=y)
 
     printInfo("Output register measured\ty = " + str(y))
+    printInfo("Performing quantum Fourier transform on input register")
 
-    # Interesting to watch - simply uncomment
-    # printAmplitudes(inputRegister)
-    # printAmplitudes(qftInputRegister)
-    # printAmplitudes(outputRegister)
-    # printEntangles(inputRegister)
+    started = stageStart("qft", registers)
+    inputRegister.qft()
+    stageEnd("qft", started, registers)
 
+    printInfo("Quantum Fourier transform complete")
     printInfo("Performing a measurement on the periodicity register")
 
-    x = qftInputRegister.measure()
+    started = stageStart("measure qft", registers)
+    x = inputRegister.measure()
+    stageEnd("measure qft", started, registers, value=x)
 
     printInfo("QFT register measured\tx = " + str(x))
 
-    if x is None:
-        return None
+    return x
 
-    printInfo("Finding the period via continued fractions")
 
-    r = cf(x, Q, N)
+def findPeriodSparse(table, Q):
+    printInfo("Performing a measurement on the output register")
 
-    printInfo("Candidate period\tr = " + str(r))
+    # Every input state is equally likely after the Hadamard, so the output register
+    # reads a^x mod N for a uniformly random x
+    started = stageStart("measure output", {})
+    y = table[int(random.random() * Q)]
+    stageEnd("measure output", started, {}, value=y)
 
-    return r
+    printInfo("Output register measured\ty = " + str(y))
+    printInfo("Building the input states where a^x mod N = y")
+
+    started = stageStart("modexp", {})
+    states = qModExpPreimage(table, y, Q)
+    stageEnd("modexp", started, {}, input={"states": len(states), "entangles": 0})
+
+    printInfo("Input register holds " + str(len(states)) + " states")
+    printInfo("Performing a measurement on the QFT of the input register")
+
+    started = stageStart("measure qft", {})
+    x = qftProgressionMeasure(states, Q)
+    stageEnd("measure qft", started, {}, value=x)
+
+    printInfo("QFT register measured\tx = " + str(x))
+
+    return x
+
+
+# Kitaev/Beauregard style phase estimation with a single control qubit that is
+# measured and recycled for each bit of x, least significant first. The phase of the
+# bits measured so far is fed forward before each Hadamard in place of the QFT, so
+# the only register simulated is the output register and memory is O(N) not O(Q)
+def findPeriodIterative(table, inputNumBits):
+    N = table.N
+    outputRegister = VectorRegister(N.bit_length())
+    outputRegister.setBasis(1)
+    registers = {"output": outputRegister}
+
+    # a^(2^k) mod N, the multiplier controlled by bit k of the input register
+    multipliers = [table.a % N]
+    for _ in range(1, inputNumBits):
+        multipliers.append(multipliers[-1] * multipliers[-1] % N)
+
+    printInfo("Performing phase estimation one control qubit at a time")
+
+    started = stageStart("phase estimation", registers)
+
+    # Every bit works in place on the register and these buffers, so no temporaries
+    # the size of the register are allocated after the first
+    vector = outputRegister.vector
+    states = np.arange(outputRegister.numStates, dtype=np.int64)
+    targets = states.copy()
+    multiplied = np.empty_like(vector)
+    zero = np.empty_like(vector)
+
+    x = 0
+    for j in range(inputNumBits):
+        # Controlled multiplication, a permutation of the output states below N
+        np.multiply(states[:N], multipliers[inputNumBits - 1 - j], out=targets[:N])
+        np.remainder(targets[:N], N, out=targets[:N])
+        multiplied[targets] = vector
+
+        # Undo the phase of the bits already measured, then Hadamard and measure
+        multiplied *= cmath.exp(complex(0.0, -2.0 * math.pi * x / (2 << j)))
+        np.add(vector, multiplied, out=zero)
+        zero /= 2.0
+        probZero = np.vdot(zero, zero).real
+        if random.random() < probZero:
+            np.multiply(zero, 1.0 / math.sqrt(probZero), out=vector)
+        else:
+            vector -= multiplied
+            vector *= 0.5 / math.sqrt(1.0 - probZero)
+            x |= 1 << j
+
+    outputRegister.changed()
+    stageEnd("phase estimation", started, registers, value=x)
+
+    printInfo("Phase estimation complete\tx = " + str(x))
+
+    return x
 
 
 ####################################################################################################
@@ -292,16 +872,63 @@ def findPeriod(a, N):
 #
 ####################################################################################################
 
-BIT_LIMIT = 12
-
-
-def bitCount(x):
-    sumBits = 0
-    while x > 0:
-        sumBits += x & 1
-        x >>= 1
+# Bytes each input state costs at the peak of each backend, as measured. The vector
+# backend holds the amplitudes, the oracle's index array, the table of a^x mod N with
+# the exponents and products it is built from, and then the FFT output. The mmap
+# backend keeps the amplitudes, index array and FFT output on disk. The sparse
+# backend keeps at most half the states as indices, and the object backend holds a
+# complex object and a list slot for each amplitude and an int object and a list
+# slot for each index. The iterative backend holds the output register, the
+# multiplied register and one branch of the measurement, and the states and their
+# images under the multiplication, for each output state
+STATE_BYTES = 80
+ITERATIVE_STATE_BYTES = 64
+MAPPED_STATE_BYTES = 40
+SPARSE_STATE_BYTES = 4
+OBJECT_STATE_BYTES = 160
+
+
+# Memory that can be allocated without swapping, including the page cache the kernel
+# would reclaim, which free memory leaves out
+def availableMemory():
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return 1 << 30
+
+
+def availableDisk(directory=None):
+    return shutil.disk_usage(directory or tempfile.gettempdir()).free
+
+
+# Largest N in bits whose input register fits in free memory, or on free disk for
+# the mmap backend, when that is shared between the given number of processes
+# simulating at once. Q is at most 2^(2 log2 N), so this is half the input bits. The
+# iterative backend only holds the output register, and multiplies states in int64
+def bitLimit(backend=DEFAULT_BACKEND, processes=1):
+    memory = availableMemory() // processes
+    if backend == "iterative":
+        states = memory // ITERATIVE_STATE_BYTES
+        return min(max(states.bit_length() - 1, 0), 31)
+
+    if backend == "object":
+        states = memory // OBJECT_STATE_BYTES
+    elif backend == "sparse":
+        states = memory // SPARSE_STATE_BYTES
+    elif backend == "mmap":
+        states = availableDisk(MMAP_DIRECTORY) // processes // MAPPED_STATE_BYTES
+    else:
+        states = memory // STATE_BYTES
 
-    return sumBits
+    return max(states.bit_length() - 1, 0) // 2
 
 
 # Greatest Common Divisor
@@ -353,6 +980,35 @@ def cf(y, Q, N):
     return r
 
 
+# Denominators of every continued fraction convergent of y / Q below N, which are
+# the periods the measurement y can point to, smallest first
+def convergents(y, Q, N):
+    denominators = []
+    previous, current = 0, 1
+    for fraction in extendedGCD(y, Q)[1:]:
+        previous, current = current, fraction * current + previous
+        if current >= N:
+            break
+        if current > 1 and current not in denominators:
+            denominators.append(current)
+
+    return denominators
+
+
+# Candidate periods for the convergent denominators of one measurement: small multiples
+# of each, for a denominator that shares a factor with the period, their LCMs with the
+# denominators and periods from earlier measurements of the same a, and the values
+# nearby. The period divides the group order, which is below N
+def candidatePeriods(denominators, previous, neighborhood, N):
+    candidates = set()
+    for q in denominators:
+        candidates.update(k * q for k in range(1, neighborhood + 2))
+        candidates.update(q * p // gcd(q, p) for p in previous)
+        candidates.update(range(max(q - neighborhood, 1), q + neighborhood + 1))
+
+    return sorted(r for r in candidates if r < N)
+
+
 # Modular Exponentiation
 def modExp(a, exp, mod):
     fx = 1
@@ -370,89 +1026,281 @@ def pick(N):
     return a
 
 
-def checkCandidates(a, r, N, neighborhood):
-    if r is None:
+# Table of a^x mod N, grown on demand and shared by the oracle stage, the candidate
+# checks and the final exponentiation. Lookups past the end fall back to modExp
+class ModExpTable:
+    def __init__(self, a, N, size=1):
+        self.a = a
+        self.N = N
+        self.values = [1 % N] if np is None else np.ones(1, dtype=np.int64) % N
+        self.extend(size)
+
+    def extend(self, size):
+        count = len(self.values)
+        if size <= count:
+            return
+
+        if np is None:
+            fx = self.values[-1]
+            for _ in range(count, size):
+                fx = fx * self.a % self.N
+                self.values.append(fx)
+            return
+
+        # Each doubling multiplies the computed prefix by a^count mod N
+        size = max(size, 2 * count)
+        values = np.empty(size, dtype=np.int64)
+        values[:count] = self.values
+        while count < size:
+            step = min(count, size - count)
+            values[count : count + step] = (
+                values[:step] * modExp(self.a, count, self.N) % self.N
+            )
+            count += step
+
+        self.values = values
+
+    def __getitem__(self, exp):
+        if exp <= 0:
+            return 1
+        if exp < len(self.values):
+            return int(self.values[exp])
+
+        return modExp(self.a, exp, self.N)
+
+    # a^x mod N for x in [start, stop), scaling the first stop - start entries by
+    # a^start so the table only grows to the length of the range
+    def range(self, start, stop):
+        if np is None:
+            self.extend(stop)
+            return self.values[start:stop]
+
+        return (
+            self.batch(np.arange(stop - start, dtype=np.int64)) * self[start] % self.N
+        )
+
+    # Look up an array of exponents at once, growing the table to cover them
+    def batch(self, exps):
+        if np is None:
+            self.extend(max(exps) + 1)
+            return [self[exp] for exp in exps]
+
+        exps = np.maximum(np.asarray(exps, dtype=np.int64), 0)
+        if len(exps) == 0:
+            return exps
+
+        self.extend(int(exps.max()) + 1)
+        return self.values[exps]
+
+
+# Tests every candidate in one batched lookup, returning the smallest r for which
+# a^(a + r) = a^a mod N. Every such r is a multiple of the period
+def checkCandidates(table, candidates):
+    if len(candidates) == 0:
         return None
 
-    # Check multiples
-    for k in range(1, neighborhood + 2):
-        tR = k * r
-        if modExp(a, a, N) == modExp(a, a + tR, N):
-            return tR
+    a = table.a
+    target = table[a]
+    matches = table.batch([a + r for r in candidates])
+    if np is None:
+        matches = [x for x, fx in enumerate(matches) if fx == target]
+    else:
+        matches = np.flatnonzero(matches == target)
 
-    # Check lower neighborhood
-    for tR in range(r - neighborhood, r):
-        if modExp(a, a, N) == modExp(a, a + tR, N):
-            return tR
+    if len(matches) == 0:
+        return None
 
-    # Check upper neigborhood
-    for tR in range(r + 1, r + neighborhood + 1):
-        if modExp(a, a, N) == modExp(a, a + tR, N):
-            return tR
+    return candidates[matches[0]]
 
-    return None
 
+# One attempt at finding a period of a, or of a random a if None, returning the table
+# of a^x mod N and the period, or None if the attempt should be retried. history maps
+# each a to the denominators and periods its earlier measurements gave
+def attemptPeriod(N, neighborhood, backend, a=None, history=None, cached=True):
+    while a is None or a < 2:
+        a = pick(N)
 
-def shors(N, attempts=1, neighborhood=0.0, numPeriods=1):
-    if N.bit_length() > BIT_LIMIT or N < 3:
-        return False
+    d = gcd(a, N)
+    if d > 1:
+        printInfo("Found factors classically, re-attempt")
+        return None
 
-    periods = []
-    neighborhood = math.floor(N * neighborhood) + 1
+    previous = [] if history is None else history.setdefault(a, [])
 
-    printInfo("N = " + str(N))
-    printInfo("Neighborhood = " + str(neighborhood))
-    printInfo("Number of periods = " + str(numPeriods))
+    table = ModExpTable(a, N)
+    x, Q = measurePeriod(table, backend, cached)
 
-    for attempt in range(attempts):
-        printInfo("\nAttempt #" + str(attempt))
+    started = stageStart("candidates", {})
+    denominators = [] if x is None else convergents(x, Q, N)
 
-        a = pick(N)
-        while a < 2:
-            a = pick(N)
+    printInfo("Convergent denominators\t" + str(denominators))
+    printInfo("Checking convergents, multiples, nearby values and earlier measurements")
 
-        d = gcd(a, N)
-        if d > 1:
-            printInfo("Found factors classically, re-attempt")
-            continue
+    candidates = candidatePeriods(denominators, previous, neighborhood, N)
+    r = checkCandidates(table, candidates)
+    stageEnd("candidates", started, {}, value=r, candidates=len(candidates))
+    previous.extend(denominators)
+
+    if r is None:
+        printInfo("Period was not found, re-attempt")
+        return None
 
-        r = findPeriod(a, N)
+    if (r % 2) > 0:
+        printInfo("Period was odd, re-attempt")
+        return None
 
-        printInfo("Checking candidate period, nearby values, and multiples")
+    d = table[r // 2]
+    if r == 0 or d == (N - 1):
+        printInfo("Period was trivial, re-attempt")
+        return None
 
-        r = checkCandidates(a, r, N, neighborhood)
+    printInfo("Period found\tr = " + str(r))
+    previous.append(r)
 
-        if r is None:
-            printInfo("Period was not found, re-attempt")
-            continue
+    return table, r
 
-        if (r % 2) > 0:
-            printInfo("Period was odd, re-attempt")
-            continue
 
-        d = modExp(a, (r // 2), N)
-        if r == 0 or d == (N - 1):
-            printInfo("Period was trivial, re-attempt")
-            continue
+def factorsFromPeriods(table, periods):
+    printInfo("\nFinding least common multiple of all periods")
+
+    r = 1
+    for period in periods:
+        d = gcd(period, r)
+        r = (r * period) // d
+
+    N = table.N
+    b = table[r // 2]
+    f1 = gcd(N, b + 1)
+    f2 = gcd(N, b - 1)
+
+    return [f1, f2]
+
 
-        printInfo("Period found\tr = " + str(r))
+# Runs the given attempts, yielding None after each one until numPeriods periods of the
+# same a are in and give non-trivial factors, which are yielded instead. The periods
+# of one a are collected from successive attempts. If cached is set, the distribution
+# of its measurement is cached once a first period of a is found, and the later
+# attempts sample it rather than simulate again
+def attemptFactors(N, attempts, neighborhood, numPeriods, backend, cached=True):
+    a = None
+    history = {}
+    periods = []
+    for attempt in attempts:
+        printInfo("\nAttempt #" + str(attempt))
+
+        result = attemptPeriod(N, neighborhood, backend, a, history, cached)
+        if result is None:
+            yield None
+            continue
 
+        table, r = result
+        a = table.a
         periods.append(r)
         if len(periods) < numPeriods:
+            if cached:
+                cacheDistribution(table, backend)
+            yield None
             continue
 
-        printInfo("\nFinding least common multiple of all periods")
+        factors = factorsFromPeriods(table, periods)
+        if factors[0] in (1, N):
+            printInfo("Factors were trivial, re-attempt")
+            a = None
+            periods = []
+            yield None
+            continue
 
-        r = 1
-        for period in periods:
-            d = gcd(period, r)
-            r = (r * period) // d
+        yield factors
 
-        b = modExp(a, (r // 2), N)
-        f1 = gcd(N, b + 1)
-        f2 = gcd(N, b - 1)
 
-        return [f1, f2]
+def shors(
+    N,
+    attempts=1,
+    neighborhood=0.0,
+    numPeriods=1,
+    backend=DEFAULT_BACKEND,
+    workers=1,
+    cached=True,
+):
+    if N.bit_length() > bitLimit(backend, workers) or N < 3:
+        return False
+
+    neighborhood = math.floor(N * neighborhood) + 1
+
+    printInfo("N = " + str(N))
+    printInfo("Neighborhood = " + str(neighborhood))
+    printInfo("Number of periods = " + str(numPeriods))
+
+    if workers > 1:
+        return shorsParallel(N, attempts, neighborhood, numPeriods, backend, workers)
+
+    for factors in attemptFactors(
+        N, range(attempts), neighborhood, numPeriods, backend, cached
+    ):
+        if factors is not None:
+            return factors
+
+    return None
+
+
+# Entry point for worker processes, which take attempt numbers from tasks until they
+# get None and put the outcome of each attempt in results, like shors() would. A
+# worker's few attempts on an a would not pay back building its distribution, so
+# they simulate every measurement
+def attemptFactorsWorker(
+    N, neighborhood, numPeriods, backend, verbose, seed, tasks, results
+):
+    global printInfo
+    printInfo = printVerbose if verbose else printNone
+    random.seed(seed)
+
+    attempts = iter(tasks.get, None)
+    for factors in attemptFactors(
+        N, attempts, neighborhood, numPeriods, backend, False
+    ):
+        results.put(factors)
+
+
+# Runs the attempts of shors() across worker processes, each with its own seed drawn
+# from this process' generator and its own a, and stops them all once one of them
+# has factored N or every attempt is done
+def shorsParallel(N, attempts, neighborhood, numPeriods, backend, workers):
+    tasks = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    for attempt in range(attempts):
+        tasks.put(attempt)
+    for _ in range(workers):
+        tasks.put(None)
+
+    verbose = printInfo is not printNone
+    processes = []
+    for _ in range(min(workers, attempts)):
+        seed = random.getrandbits(64)
+        args = (N, neighborhood, numPeriods, backend, verbose, seed, tasks, results)
+        process = multiprocessing.Process(target=attemptFactorsWorker, args=args)
+        process.start()
+        processes.append(process)
+
+    try:
+        remaining = attempts
+        while remaining > 0:
+            try:
+                factors = results.get(timeout=1.0)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    break
+                continue
+
+            remaining -= 1
+            if factors is not None:
+                return factors
+    finally:
+        # Attempts still running are of no use, so stop their processes rather than
+        # waiting for the simulations to finish
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
 
     return None
 
@@ -487,6 +1335,29 @@ def parseArgs():
         default=2,
         help="Number of periods to get before determining least common multiple",
     )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        choices=BACKENDS,
+        default=DEFAULT_BACKEND,
+        help="Simulation backend: pure Python registers, numpy state vectors,"
+        + " memory-mapped state vectors on disk,"
+        + " sparse measure-output-first period finding,"
+        + " or iterative phase estimation with one control qubit",
+    )
+    parser.add_argument(
+        "-d",
+        "--mmap-dir",
+        default=None,
+        help="Directory for the register files of the mmap backend",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes to run attempts across",
+    )
     parser.add_argument("-v", "--verbose", type=bool, default=True, help="Verbose")
     parser.add_argument("N", type=int, help="The integer to factor")
     return parser.parse_args()
@@ -501,7 +1372,17 @@ def main():
     else:
         printInfo = printNone
 
-    factors = shors(args.N, args.attempts, args.neighborhood, args.periods)
+    global MMAP_DIRECTORY
+    MMAP_DIRECTORY = args.mmap_dir
+
+    factors = shors(
+        args.N,
+        args.attempts,
+        args.neighborhood,
+        args.periods,
+        args.backend,
+        args.workers,
+    )
     if factors is not None:
         print("Factors:\t" + str(factors[0]) + ", " + str(factors[1]))
 
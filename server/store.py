@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Iterator, Optional
+
+from cache import PrivateNumbers
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS keys (
+    fingerprint TEXT PRIMARY KEY,
+    n TEXT NOT NULL,
+    e TEXT NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    times_seen INTEGER NOT NULL,
+    last_source TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    p TEXT,
+    q TEXT,
+    d TEXT
+);
+CREATE INDEX IF NOT EXISTS keys_by_modulus ON keys (n);
+CREATE TABLE IF NOT EXISTS sightings (
+    fingerprint TEXT NOT NULL,
+    seen REAL NOT NULL,
+    source TEXT
+);
+"""
+"""Every key is one row of keys, and every time it is received
+is appended to sightings. Big integers are stored as decimal text."""
+
+RECORD = """
+INSERT INTO keys (fingerprint, n, e, first_seen, last_seen, times_seen, last_source)
+VALUES (?, ?, ?, ?, ?, 1, ?)
+ON CONFLICT (fingerprint) DO UPDATE SET
+    last_seen = excluded.last_seen,
+    times_seen = times_seen + 1,
+    last_source = excluded.last_source
+"""
+
+SIGHTING = "INSERT INTO sightings (fingerprint, seen, source) VALUES (?, ?, ?)"
+
+RESULT = "UPDATE keys SET status = ?, p = ?, q = ?, d = ? WHERE n = ? AND e = ?"
+
+
+class KeyStore(threading.Thread):
+    """This is a thread that writes every public key we receive to an SQLite database.
+    Writes are queued and committed in batches, so recording a key never blocks.
+    All logic is in the run method."""
+
+    path: str
+    """Path of the SQLite database."""
+    batch_size: int
+    """Maximum number of writes committed in one transaction."""
+
+    def __init__(self, path: str, batch_size: int = 512) -> None:
+        self.path = path
+        self.batch_size = batch_size
+        self._writes: queue.SimpleQueue = queue.SimpleQueue()
+        self._readers = threading.local()
+
+        db = self._connect()
+        db.execute("PRAGMA journal_mode = WAL")
+        db.executescript(SCHEMA)
+        db.close()
+
+        super().__init__(daemon=True)
+
+    def record(self, fingerprint: str, n: int, e: int, source: str) -> None:
+        """Queues a sighting of a public key from a client address."""
+        now = time.time()
+        self._writes.put((RECORD, (fingerprint, str(n), str(e), now, now, source)))
+        self._writes.put((SIGHTING, (fingerprint, now, source)))
+
+    def set_result(
+        self, n: int, e: int, status: str, private: Optional[PrivateNumbers] = None
+    ) -> None:
+        """Queues an update of the factoring status of a key,
+        with its private numbers if it was broken."""
+        p, q, d = (str(x) for x in private) if private is not None else (None,) * 3
+        self._writes.put((RESULT, (status, p, q, d, str(n), str(e))))
+
+    def flush(self) -> None:
+        """Waits until every write queued so far has been committed."""
+        done = threading.Event()
+        self._writes.put(done)
+        done.wait()
+
+    def by_fingerprint(self, fingerprint: str) -> Optional[dict[str, Any]]:
+        """Returns the stored key with a fingerprint, if there is one."""
+        rows = self._query("SELECT * FROM keys WHERE fingerprint = ?", (fingerprint,))
+        return next(rows, None)
+
+    def by_modulus(self, n: int) -> list[dict[str, Any]]:
+        """Returns the stored keys with a modulus."""
+        return list(self._query("SELECT * FROM keys WHERE n = ?", (str(n),)))
+
+    def public_numbers(self) -> Iterator[tuple[int, int]]:
+        """Yields n and e of every stored key."""
+        for row in self._query("SELECT n, e FROM keys", ()):
+            yield int(row["n"]), int(row["e"])
+
+    def run(self) -> None:
+        """This method commits queued writes, as many at a time as are waiting."""
+        db = self._connect()
+        while True:
+            batch = [self._writes.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+
+            flushed = [write for write in batch if isinstance(write, threading.Event)]
+            with db:
+                for write in batch:
+                    if not isinstance(write, threading.Event):
+                        db.execute(*write)
+            for done in flushed:
+                done.set()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Opens a connection to the database."""
+        db = sqlite3.connect(self.path)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def _query(self, sql: str, params: tuple) -> Iterator[dict[str, Any]]:
+        """Runs a query on this thread's read connection."""
+        db = getattr(self._readers, "db", None)
+        if db is None:
+            db = self._readers.db = self._connect()
+        for row in db.execute(sql, params):
+            yield dict(row)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import os
+import socket
+from argparse import ArgumentParser, Namespace
+
+from broker import JobManager, parse_address
+from decrypt import derive_private_numbers
+from factor import DEFAULT_STAGES
+
+
+def work(address: tuple[str, int], authkey: bytes) -> None:
+    """Connects to a job broker and factors the jobs it publishes, one at a time,
+    until the broker goes away."""
+    manager = JobManager(address, authkey)
+    manager.connect()
+    jobs, started, results = manager.jobs(), manager.started(), manager.results()
+    print(f"Worker {socket.gethostname()}:{os.getpid()} connected to {address}")
+
+    while True:
+        try:
+            job_id, n, e, params = jobs.get()
+            started.put(job_id)
+        except (EOFError, ConnectionError):
+            print("Lost the connection to the broker")
+            return
+
+        stages = DEFAULT_STAGES
+        if params.get("stages") is not None:
+            stages = [stage for stage in stages if stage.name in params["stages"]]
+
+        try:
+            results.put((job_id, derive_private_numbers(n, e, stages), None))
+        except (EOFError, ConnectionError):
+            print("Lost the connection to the broker")
+            return
+        except Exception as exc:
+            results.put((job_id, None, repr(exc)))
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(
+        prog="maldetete-worker",
+        description="Factors public keys published by a maldetete server.",
+    )
+
+    parser.add_argument(
+        "-a",
+        "--address",
+        required=True,
+        help="host:port of the job broker of the server.",
+    )
+
+    parser.add_argument(
+        "-k",
+        "--broker-key",
+        required=True,
+        help="Secret shared with the server to authenticate to the broker.",
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    work(parse_address(args.address), args.broker_key.encode())